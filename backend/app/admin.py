@@ -1,12 +1,26 @@
 import os
+import io
+import csv
 import logging
+from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, status, APIRouter
-from auth import get_current_user, get_password_hash
-from database import engine
-from models import UserModel
-from schemas import UserSchema, HTTPRequest
+from sqlalchemy import select, delete, insert, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, HTTPException, status, APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from auth_utils import get_current_principal, invalidate_principal, principal_cache
+from hashing import hash_password, hash_passwords, get_hashing_stats
+from database import get_session, AsyncSessionLocal, async_engine, dialect_insert
+from models import UserModel, VerificationCodeModel, DomainStatsModel, AuditEventModel, USER_SUMMARY_COLUMNS, canonical_email
+from uploads import iter_upload_chunks, row_text
+from search import search_users, search_condition
+from audit import audit_log
+from stats import bump_stats, read_stats
+from revocation import revoke_sessions, revoke_deleted_users, DELETED_USER_TOKEN_VERSION
+from profiling import profiler
+from etags import user_etag, etag_matches, not_modified, modified
+from schemas import UserSchema, HTTPRequest, Principal, UserSummary, UserPage, UserStats, UserSearchPage, DomainStats, DomainStatsPage, AuditEvent, AuditEventPage, ProfilingRequest, ProfilingStatus, RequestProfile, BulkRowResult, BulkResult
 
 load_dotenv()
 
@@ -16,26 +30,66 @@ router = APIRouter()
 
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+ADMIN_EMAIL_CANONICAL = canonical_email(ADMIN_EMAIL) if ADMIN_EMAIL else None # None: no admin configured, every admin route answers 401
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+
+def user_listing_query(is_verified: bool | None = None, is_admin: bool | None = None, email_prefix: str | None = None):
+    query = select(*USER_SUMMARY_COLUMNS).order_by(UserModel.id)
+    if is_verified is not None:
+        query = query.where(UserModel.is_verified == is_verified)
+    if is_admin is not None:
+        query = query.where(UserModel.is_admin == is_admin)
+    if email_prefix:
+        # the same condition as prefix search, so Postgres can use the text_pattern_ops index under any collation
+        query = query.where(search_condition("prefix", canonical_email(email_prefix), async_engine.dialect.name))
+    return query
 
 @router.get('/create-admin-user')
-async def create_admin():
+async def create_admin(session: AsyncSession = Depends(get_session)):
+  if ADMIN_EMAIL_CANONICAL is None or not ADMIN_PASSWORD:
+    logger.error("Cannot create the admin user, ADMIN_EMAIL and ADMIN_PASSWORD must both be set")
+    raise HTTPException(
+      status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+      detail="Admin user is not configured."
+    )
+
   try:
-    with Session(engine) as session:
-      if session.query(UserModel).filter(UserModel.email == ADMIN_EMAIL, UserModel.is_admin == True).first():
+    if await session.scalar(select(UserModel).where(UserModel.email_canonical == ADMIN_EMAIL_CANONICAL, UserModel.is_admin == True)):
+      return HTTPRequest(
+         status=200,
+         message="Admin user already exists"
+      )
+
+    admin_id = await session.scalar(
+      dialect_insert(UserModel)
+      .values(email=ADMIN_EMAIL, email_canonical=ADMIN_EMAIL_CANONICAL, password=await hash_password(ADMIN_PASSWORD), is_admin=True)
+      .on_conflict_do_nothing()
+      .returning(UserModel.id)
+    )
+    if admin_id is not None:
+      await bump_stats(session, users=1, admins=1)
+    await session.commit()
+    if admin_id is None:
+      # lost the race to a concurrent call, or the email belongs to a regular user
+      if await session.scalar(select(UserModel.id).where(UserModel.email_canonical == ADMIN_EMAIL_CANONICAL, UserModel.is_admin == True)):
         return HTTPRequest(
            status=200,
            message="Admin user already exists"
         )
+      raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A non-admin user already owns the admin email"
+      )
 
-      admin_user = UserModel(email=ADMIN_EMAIL, password=get_password_hash(ADMIN_PASSWORD), is_admin=True)
-      if admin_user:
-        session.add(admin_user)
-        session.commit()
+    return HTTPRequest(
+       status=201,
+       message="Admin user created successfully"
+    )
 
-        return HTTPRequest(
-           status=201,
-           message="Admin user created successfully"
-        )
+  except HTTPException as e:
+    raise e
 
   except Exception as e:
     logger.error(f"Unexpected error while creating admin user: {e}", exc_info=True)
@@ -46,70 +100,176 @@ async def create_admin():
     )
 
 @router.get('/admin/me')
-async def get_current_admin_user(token: str = Depends(get_current_user)):
-  adminEmail = token
-
-  if adminEmail != ADMIN_EMAIL:
+async def get_current_admin_user(principal: Principal = Depends(get_current_principal)):
+  # is_admin comes from the cached principal (or signed claims), so this check costs no extra query
+  if ADMIN_EMAIL_CANONICAL is None or canonical_email(principal.email) != ADMIN_EMAIL_CANONICAL or not principal.is_admin:
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Unauthorized access attempt by non-admin user",
       headers={"WWW-Authenticate": "Bearer"},
     )
 
-  try:
-    with Session(engine) as session:
-      admin_user = session.query(UserModel).filter(UserModel.email == adminEmail, UserModel.is_admin == True).first()
-      if not admin_user:
+  return HTTPRequest(
+     status=200,
+     message=principal.email
+  )
+
+@router.get('/fetch-users-data', response_model=UserPage)
+async def fetch_users_data(
+    cursor: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    is_verified: bool | None = None,
+    is_admin: bool | None = None,
+    email_prefix: str | None = None,
+    token: str = Depends(get_current_admin_user),
+    session: AsyncSession = Depends(get_session)
+) -> UserPage:
+    try:
+        query = user_listing_query(is_verified, is_admin, email_prefix)
+        if cursor is not None:
+            query = query.where(UserModel.id > cursor)
+
+        rows = (await session.execute(query.limit(limit + 1))).all()
+        users = [UserSummary.model_validate(row) for row in rows[:limit]]
+
+        return UserPage(
+            users=users,
+            next_cursor=users[-1].id if len(rows) > limit else None
+        )
+
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching all users: {e}", exc_info=True)
         raise HTTPException(
-          status_code=status.HTTP_401_UNAUTHORIZED,
-          detail="Unauthorized access attempt by non-admin user",
-          headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while fetching all users.",
+            headers={"WWW-Authenticate": "Bearer"}
         )
 
-      return HTTPRequest(
-         status=200,
-         message=adminEmail
-      )
+@router.get('/stats', response_model=UserStats)
+async def fetch_user_stats(token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)) -> UserStats:
+    try:
+        # maintained on every write path and recounted by stats.run_stats_reconciler, so this never scans users
+        return await read_stats(session)
 
-  except Exception as e:
-    logger.error(f"Unexpected error while creating admin user: {e}", exc_info=True)
-    raise HTTPException(
-      status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-      detail="Unexpected error while creating admin user.",
-      headers={"WWW-Authenticate": "Bearer"}
-    )
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching user stats: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while fetching user stats.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
 
-@router.get('/fetch-users-data')
-async def fetch_users_data(token: str = Depends(get_current_admin_user)):
+@router.get('/search-users', response_model=UserSearchPage)
+async def search_user_emails(
+    q: str = Query(..., min_length=1, max_length=254),
+    mode: str = Query("prefix", pattern="^(prefix|substring|domain)$"),
+    cursor: int | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    token: str = Depends(get_current_admin_user),
+    session: AsyncSession = Depends(get_session)
+) -> UserSearchPage:
     try:
-        with Session(engine) as session:
-            users = session.query(UserModel).all()
-
-            return HTTPRequest(
-               status=200,
-               message=users
+        if mode == "substring" and len(q.strip()) < 3:
+            # trigrams need three characters, anything shorter would scan the whole table
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Substring search needs at least 3 characters"
             )
 
+        rows, total, next_cursor = await search_users(session, mode, q, cursor, limit)
+
+        return UserSearchPage(
+            users=[UserSummary.model_validate(row) for row in rows],
+            total=total,
+            next_cursor=next_cursor
+        )
+
+    except HTTPException as e:
+        raise e
+
     except Exception as e:
-        logger.error(f"Unexpected error while fetching all users: {e}", exc_info=True)
+        logger.error(f"Unexpected error while searching users: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Unexpected error while fetching all users.",
+            detail="Unexpected error while searching users.",
             headers={"WWW-Authenticate": "Bearer"}
         )
 
+@router.get('/domain-stats', response_model=DomainStatsPage)
+async def fetch_domain_stats(
+    limit: int = Query(100, ge=1, le=1000),
+    token: str = Depends(get_current_admin_user),
+    session: AsyncSession = Depends(get_session)
+) -> DomainStatsPage:
+    try:
+        # precomputed by search.run_domain_stats_refresh, so this never aggregates the users table
+        rows = (await session.scalars(
+            select(DomainStatsModel).order_by(DomainStatsModel.users.desc(), DomainStatsModel.domain).limit(limit)
+        )).all()
+
+        return DomainStatsPage(
+            domains=[
+                DomainStats(domain=row.domain, users=row.users, verified=row.verified, verified_ratio=row.verified / row.users if row.users else 0.0)
+                for row in rows
+            ],
+            refreshed_at=rows[0].refreshed_at if rows else None
+        )
+
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching domain stats: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while fetching domain stats.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+@router.get('/export-users')
+async def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    is_verified: bool | None = None,
+    is_admin: bool | None = None,
+    email_prefix: str | None = None,
+    token: str = Depends(get_current_admin_user)
+):
+    query = user_listing_query(is_verified, is_admin, email_prefix).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+    async def rows():
+        # the request-scoped session is closed before the body is streamed, so the export opens its own
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query)
+
+            if format == "csv":
+                yield "id,email,is_verified,is_admin\n"
+
+            async for partition in result.partitions():
+                if format == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows((row.id, row.email, bool(row.is_verified), bool(row.is_admin)) for row in partition)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(UserSummary.model_validate(row).model_dump_json() + "\n" for row in partition)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type)
+
 @router.get('/delete-all-users')
-async def delete_all_users(token: str = Depends(get_current_admin_user)):
+async def delete_all_users(request: Request, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)):
     try:
-        with Session(engine) as session:
-            deleted_count = session.query(UserModel).filter(UserModel.is_admin != True).delete()
-            session.commit()
-
-            if deleted_count == 0:
-                return HTTPRequest(
-                   status=404,
-                   message='No users to delete'
-                )
+        non_admin_ids = select(UserModel.id).where(UserModel.is_admin != True)
+        verified_count = await session.scalar(select(func.count()).where(UserModel.is_admin != True, UserModel.is_verified == True))
+        codes_count = (await session.execute(delete(VerificationCodeModel).where(VerificationCodeModel.user_id.in_(non_admin_ids)))).rowcount
+        await revoke_deleted_users(session, non_admin_ids)
+        deleted_count = (await session.execute(delete(UserModel).where(UserModel.is_admin != True))).rowcount
+        await bump_stats(session, users=-deleted_count, verified=-verified_count, pending_codes=-codes_count)
+        await session.commit()
+        invalidate_principal()
+        audit_log.record("admin_delete_all_users", request=request, actor=token.message, detail=f"{deleted_count} users")
+
+        if deleted_count == 0:
+            return HTTPRequest(
+               status=404,
+               message='No users to delete'
+            )
     except Exception as e:
         logger.error(f"Unexpected error while deleting all users: {e}", exc_info=True)
         raise HTTPException(
@@ -118,21 +278,32 @@ async def delete_all_users(token: str = Depends(get_current_admin_user)):
             headers={"WWW-Authenticate": "Bearer"}
         )
 
-@router.get('/fetch-user-data/{email}')
-async def fetch_user_data(email: str, token: str = Depends(get_current_admin_user)):
+@router.get('/fetch-user-data/{email}', response_model=UserSummary)
+async def fetch_user_data(email: str, request: Request, response: Response, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)) -> UserSummary:
     try:
-        with Session(engine) as session:
-            user = session.query(UserModel).filter(UserModel.email == email).first()
-            if user:
-                return HTTPRequest(
-                   status=200,
-                   message=user
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="No user found."
-                )
+        # if the user was active on this worker recently their cached principal knows the current row version
+        cached = principal_cache.get(canonical_email(email))
+        if cached is not None and cached.row_version is not None and etag_matches(request, user_etag(cached.id, cached.row_version)):
+            return not_modified("fetch-user-data", user_etag(cached.id, cached.row_version))
+
+        user = (await session.execute(
+            select(*USER_SUMMARY_COLUMNS, UserModel.row_version).where(UserModel.email_canonical == canonical_email(email))
+        )).first()
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No user found."
+            )
+
+        etag = user_etag(user.id, user.row_version)
+        if etag_matches(request, etag):
+            return not_modified("fetch-user-data", etag)
+        modified("fetch-user-data", response, etag)
+
+        return UserSummary.model_validate(user)
+
+    except HTTPException as e:
+        raise e
 
     except Exception as e:
         logger.error(f"Unexpected error while fetching user: {e}", exc_info=True)
@@ -143,24 +314,32 @@ async def fetch_user_data(email: str, token: str = Depends(get_current_admin_use
         )
 
 @router.get('/delete-user/{email}')
-async def delete_user(email: str, token: str = Depends(get_current_admin_user)):
+async def delete_user(email: str, request: Request, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)):
     try:
-        with Session(engine) as session:
-            user = session.query(UserModel).filter(UserModel.email == email).first()
-            if user:
-                session.delete(user)
-                session.commit()
-
-                return HTTPRequest(
-                   status=201,
-                   message="User deleted successfully"
-                )
+        user = await session.scalar(select(UserModel).where(UserModel.email_canonical == canonical_email(email)))
+        if user:
+            codes_count = (await session.execute(
+                delete(VerificationCodeModel)
+                .where(VerificationCodeModel.user_id == user.id)
+                .execution_options(synchronize_session=False)
+            )).rowcount
+            await session.delete(user)
+            revoke_sessions(session, user.id, DELETED_USER_TOKEN_VERSION)
+            await bump_stats(session, users=-1, verified=-int(bool(user.is_verified)), admins=-int(bool(user.is_admin)), pending_codes=-codes_count)
+            await session.commit()
+            invalidate_principal(email)
+            audit_log.record("admin_delete_user", email, request, actor=token.message)
 
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail='User not found.'
-                )
+            return HTTPRequest(
+               status=201,
+               message="User deleted successfully"
+            )
+
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail='User not found.'
+            )
     except Exception as e:
         logger.error(f"Unexpected error while deleting user: {e}", exc_info=True)
         raise HTTPException(
@@ -170,31 +349,253 @@ async def delete_user(email: str, token: str = Depends(get_current_admin_user)):
         )
 
 @router.get('/create-user')
-async def create_new_user(data: UserSchema, token: str = Depends(get_current_admin_user)):
+async def create_new_user(data: UserSchema, request: Request, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)):
     try:
-        with Session(engine) as session:
+        hashed_password = await hash_password(data.password)
+
+        user_id = await session.scalar(
+            dialect_insert(UserModel)
+            .values(email=data.email, email_canonical=canonical_email(data.email), password=hashed_password)
+            .on_conflict_do_nothing()
+            .returning(UserModel.id)
+        )
+        if user_id is not None:
+            await bump_stats(session, users=1)
+        await session.commit()
+        if user_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already exists"
+            )
 
-            if session.query(UserModel).filter(UserModel.email == data.email).first():
+        audit_log.record("admin_create_user", data.email, request, actor=token.message)
+
+        return HTTPRequest(
+           status=200,
+           message='New user created successfully'
+        )
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        logger.error(f"Unexpected error while creating a new user: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while creating a new user.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+@router.get('/audit-events', response_model=AuditEventPage)
+async def fetch_audit_events(
+    event: str | None = None,
+    email: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    token: str = Depends(get_current_admin_user),
+    session: AsyncSession = Depends(get_session)
+) -> AuditEventPage:
+    try:
+        # newest first, the cursor is the (created_at, id) of the last event on the previous page
+        query = select(AuditEventModel).order_by(AuditEventModel.created_at.desc(), AuditEventModel.id.desc())
+        if event:
+            query = query.where(AuditEventModel.event == event)
+        if email:
+            query = query.where(AuditEventModel.email == canonical_email(email))
+        if cursor:
+            try:
+                created_at, event_id = cursor.rsplit("_", 1)
+                position = (datetime.fromisoformat(created_at), int(event_id))
+            except ValueError:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Username already exists"
+                    detail="Invalid cursor"
                 )
+            query = query.where(tuple_(AuditEventModel.created_at, AuditEventModel.id) < position)
 
-            hashed_password = get_password_hash(data.password)
+        rows = (await session.scalars(query.limit(limit + 1))).all()
+        last = rows[limit - 1] if len(rows) > limit else None
 
-            user = UserModel(email=data.email, password=hashed_password)
-            session.add(user)
-            session.commit()
+        return AuditEventPage(
+            events=[AuditEvent.model_validate(row) for row in rows[:limit]],
+            next_cursor=f"{last.created_at.isoformat()}_{last.id}" if last else None
+        )
 
-            return HTTPRequest(
-               status=200,
-               message='New user created successfully'
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching audit events: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while fetching audit events.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+def profiling_status() -> ProfilingStatus:
+    return ProfilingStatus(
+        enabled=profiler.enabled,
+        route=profiler.route,
+        sample_rate=profiler.sample_rate,
+        remaining=max(0, profiler.remaining) if profiler.enabled else 0,
+        stored=len(profiler.profiles)
+    )
+
+# profiling state is per worker process, with WEB_CONCURRENCY > 1 each call reaches whichever worker accepted it
+@router.post('/profiling/start', response_model=ProfilingStatus)
+async def start_profiling(data: ProfilingRequest, token: str = Depends(get_current_admin_user)) -> ProfilingStatus:
+    if not 0 < data.sample_rate <= 1 or data.duration_seconds <= 0 or data.max_profiles < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="sample_rate must be in (0, 1], duration_seconds and max_profiles must be positive"
+        )
+
+    profiler.start(data.route, data.sample_rate, data.duration_seconds, data.max_profiles)
+    return profiling_status()
+
+@router.post('/profiling/stop', response_model=ProfilingStatus)
+async def stop_profiling(token: str = Depends(get_current_admin_user)) -> ProfilingStatus:
+    profiler.stop()
+    return profiling_status()
+
+@router.get('/profiling/profiles', response_model=list[RequestProfile])
+async def fetch_profiles(token: str = Depends(get_current_admin_user)) -> list[RequestProfile]:
+    return [
+        RequestProfile(**{key: value for key, value in profile.items() if key != "samples"}, samples=sum(profile["samples"].values()))
+        for profile in list(profiler.profiles)
+    ]
+
+@router.get('/profiling/flamegraph', response_class=PlainTextResponse)
+async def fetch_flamegraph(profile_id: int | None = None, token: str = Depends(get_current_admin_user)):
+    # collapsed stacks, e.g. `flamegraph.pl profile.txt > profile.svg` or drop the file into speedscope.app
+    return PlainTextResponse(
+        profiler.collapsed(profile_id),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id or "all"}.txt"'}
+    )
+
+@router.get('/hashing-metrics')
+async def fetch_hashing_metrics(token: str = Depends(get_current_admin_user)):
+    return get_hashing_stats()
+
+def bulk_result(results: list) -> BulkResult:
+    succeeded = sum(1 for result in results if result.status in ("created", "deleted"))
+    return BulkResult(processed=len(results), succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+@router.post('/bulk-create-users', response_model=BulkResult)
+async def bulk_create_users(request: Request, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)) -> BulkResult:
+    results = []
+    seen = set()
+    try:
+        async for chunk in iter_upload_chunks(request, BULK_CHUNK_SIZE):
+            candidates = []
+            for row_number, row in chunk:
+                email = row_text(row, "email")
+                password = row_text(row, "password")
+                if email is None or password is None:
+                    results.append(BulkRowResult(row=row_number, email=email, status="invalid", detail="email and password must be non-empty strings"))
+                elif canonical_email(email) in seen:
+                    results.append(BulkRowResult(row=row_number, email=email, status="duplicate", detail="Email repeated in upload"))
+                else:
+                    seen.add(canonical_email(email))
+                    candidates.append((row_number, email, password))
+
+            if not candidates:
+                continue
+
+            existing = set(await session.scalars(
+                select(UserModel.email_canonical).where(UserModel.email_canonical.in_([canonical_email(email) for _, email, _ in candidates]))
+            ))
+            new_users = [candidate for candidate in candidates if canonical_email(candidate[1]) not in existing]
+            results.extend(
+                BulkRowResult(row=row_number, email=email, status="exists", detail="Username already exists")
+                for row_number, email, _ in candidates if canonical_email(email) in existing
             )
 
+            if not new_users:
+                continue
+
+            hashed_passwords = await hash_passwords([password for _, _, password in new_users])
+            try:
+                await session.execute(
+                    insert(UserModel),
+                    [
+                        {"email": email, "email_canonical": canonical_email(email), "password": hashed}
+                        for (_, email, _), hashed in zip(new_users, hashed_passwords)
+                    ]
+                )
+                await bump_stats(session, users=len(new_users))
+                await session.commit()
+                results.extend(BulkRowResult(row=row_number, email=email, status="created") for row_number, email, _ in new_users)
+                for _, email, _ in new_users:
+                    audit_log.record("admin_create_user", email, request, actor=token.message, detail="bulk")
+            except IntegrityError:
+                # another writer inserted one of these emails after the existence check
+                await session.rollback()
+                results.extend(
+                    BulkRowResult(row=row_number, email=email, status="error", detail="Chunk conflicted with a concurrent insert, please retry")
+                    for row_number, email, _ in new_users
+                )
+
+        return bulk_result(results)
+
+    except HTTPException as e:
+        raise e
+
     except Exception as e:
-        logger.error(f"Unexpected error while creating a new user: {e}", exc_info=True)
+        logger.error(f"Unexpected error while bulk creating users: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Unexpected error while creating a new user.",
+            detail="Unexpected error while bulk creating users.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+@router.post('/bulk-delete-users', response_model=BulkResult)
+async def bulk_delete_users(request: Request, token: str = Depends(get_current_admin_user), session: AsyncSession = Depends(get_session)) -> BulkResult:
+    results = []
+    seen = set()
+    try:
+        async for chunk in iter_upload_chunks(request, BULK_CHUNK_SIZE):
+            emails = {canonical_email(email) for _, row in chunk if (email := row_text(row, "email"))} - seen
+            deleted = {}
+
+            if emails:
+                user_ids = select(UserModel.id).where(UserModel.email_canonical.in_(emails), UserModel.is_admin != True)
+                codes_count = (await session.execute(delete(VerificationCodeModel).where(VerificationCodeModel.user_id.in_(user_ids)))).rowcount
+                await revoke_deleted_users(session, user_ids)
+                rows = (await session.execute(
+                    delete(UserModel)
+                    .where(UserModel.email_canonical.in_(emails), UserModel.is_admin != True)
+                    .returning(UserModel.email_canonical, UserModel.email, UserModel.is_verified)
+                    .execution_options(synchronize_session=False)
+                )).all()
+                deleted = {row.email_canonical: row.email for row in rows}
+                await bump_stats(session, users=-len(rows), verified=-sum(1 for row in rows if row.is_verified), pending_codes=-codes_count)
+                await session.commit()
+
+            for row_number, row in chunk:
+                email = row_text(row, "email")
+                if email is None:
+                    results.append(BulkRowResult(row=row_number, status="invalid", detail="email must be a non-empty string"))
+                elif canonical_email(email) in seen:
+                    results.append(BulkRowResult(row=row_number, email=email, status="duplicate", detail="Email repeated in upload"))
+                else:
+                    seen.add(canonical_email(email))
+                    if canonical_email(email) in deleted:
+                        invalidate_principal(deleted.pop(canonical_email(email)))
+                        audit_log.record("admin_delete_user", email, request, actor=token.message, detail="bulk")
+                        results.append(BulkRowResult(row=row_number, email=email, status="deleted"))
+                    else:
+                        results.append(BulkRowResult(row=row_number, email=email, status="not_found", detail="User not found."))
+
+        return bulk_result(results)
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        logger.error(f"Unexpected error while bulk deleting users: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected error while bulk deleting users.",
             headers={"WWW-Authenticate": "Bearer"}
         )
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from fastapi import Request
+from sqlalchemy import insert
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import AuditEventModel, canonical_email
+from metrics import Counter, Gauge, register
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true").lower() == "true"
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 10000)) # events held in memory before the oldest are dropped
+AUDIT_FLUSH_BATCH_SIZE = int(os.getenv("AUDIT_FLUSH_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", 2))
+
+audit_events = register(Counter("audit_events_total", "Audit events by outcome", ("outcome",)))
+
+def client_ip(request: Request | None) -> str | None:
+    if request is None or request.client is None:
+        return None
+    return request.client.host
+
+class AuditLog:
+    def __init__(self, enabled: bool = AUDIT_ENABLED, max_size: int = AUDIT_BUFFER_SIZE, batch_size: int = AUDIT_FLUSH_BATCH_SIZE, interval: float = AUDIT_FLUSH_INTERVAL_SECONDS):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.buffer = deque()
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "failed_flushes": 0, "flushes": 0}
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    def record(self, event: str, email: str | None = None, request: Request | None = None, actor: str | None = None, detail: str | None = None):
+        # never touches the database, the request only pays for an append
+        if not self.enabled:
+            return
+
+        if len(self.buffer) >= self.max_size:
+            # ring buffer: losing the oldest unflushed event beats making logins wait on a slow database
+            self.buffer.popleft()
+            self.stats["dropped"] += 1
+            audit_events.inc(outcome="dropped")
+
+        self.buffer.append({
+            "created_at": datetime.utcnow(),
+            "event": event,
+            "email": canonical_email(email) if email else None,
+            "actor": actor,
+            "ip": client_ip(request),
+            "detail": detail,
+        })
+        self.stats["recorded"] += 1
+        audit_events.inc(outcome="recorded")
+
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self.enabled and self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Could not write {len(self.buffer)} audit events on shutdown: {e}")
+
+    async def flush(self) -> int:
+        written = 0
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+
+            try:
+                async with AsyncSessionLocal() as session:
+                    await session.execute(insert(AuditEventModel), batch)
+                    await session.commit()
+            except BaseException:
+                # also on cancellation at shutdown: put the batch back in front, anything that no longer fits is counted as dropped
+                room = self.max_size - len(self.buffer)
+                self.buffer.extendleft(reversed(batch[-room:] if room > 0 else []))
+                lost = len(batch) - max(0, room)
+                if lost > 0:
+                    self.stats["dropped"] += lost
+                    audit_events.inc(lost, outcome="dropped")
+                self.stats["failed_flushes"] += 1
+                raise
+
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(batch)
+            audit_events.inc(len(batch), outcome="written")
+            written += len(batch)
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error while writing audit events, {len(self.buffer)} buffered: {e}", exc_info=True)
+                await asyncio.sleep(self.interval)
+
+audit_log = AuditLog()
+
+register(Gauge("audit_buffer_depth", "Audit events waiting to be written", callback=lambda: len(audit_log.buffer)))
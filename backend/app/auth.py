@@ -1,93 +1,113 @@
 import logging
-from datetime import datetime, timedelta
-import secrets
+from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, status, APIRouter
-from passlib.context import CryptContext
-from models import UserModel, VerificationCodeModel
-from database import engine
-from schemas import UserUpdate, UserSchema, VerifyCodeResponse, Token, ForgotPasswordRequest, UpdatePasswordRequest, HTTPRequest
-from auth_utils import get_password_hash, create_access_token, send_verification_email, get_current_user
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, HTTPException, status, APIRouter, BackgroundTasks, Request, Response
+from models import UserModel, RefreshTokenModel, USER_SUMMARY_COLUMNS, canonical_email
+from database import get_session, dialect_insert
+from schemas import UserUpdate, UserSchema, VerifyCodeResponse, Token, ForgotPasswordRequest, UpdatePasswordRequest, HTTPRequest, RefreshRequest, UserSummary, Principal
+from auth_utils import create_access_token, send_verification_email, get_current_user, get_current_principal, get_token_claims, invalidate_principal, decode_access_token, oauth2_scheme
+from hashing import hash_password, check_password, needs_rehash, rehash_password
+from rate_limit import login_rate_limit, verify_rate_limit, forgot_password_rate_limit, register_rate_limit
+from verification_codes import new_verification_code, consume_verification_code, issue_verification_code
+from refresh_tokens import issue_refresh_token, rotate_refresh_token, revoke_refresh_tokens, hash_refresh_token
+from revocation import revoke_access_token, revoke_sessions
+from audit import audit_log
+from stats import bump_stats
+from etags import user_etag, etag_matches, not_modified, modified
 
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
 logger = logging.getLogger("uvicorn")
 
 router = APIRouter()
 
-@router.post('/register')
-async def register_user(user: UserSchema):
+@router.post('/register', dependencies=[Depends(register_rate_limit)])
+async def register_user(user: UserSchema, request: Request, session: AsyncSession = Depends(get_session)):
 
-    with Session(engine) as session:
-        try:
+    try:
 
-            if session.query(UserModel).filter(UserModel.email == user.email).first():
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Username already exists"
-                )
+        # an indexed probe turns a taken email away before paying for a full Argon2 hash
+        if await session.scalar(select(UserModel.id).where(UserModel.email_canonical == canonical_email(user.email))):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already exists"
+            )
 
-            hashed_password = get_password_hash(user.password)
+        hashed_password = await hash_password(user.password)
 
-            user = UserModel(email=user.email, password=hashed_password)
-            session.add(user)
-            session.commit()
-            session.refresh(user)
+        # the unique index on email decides who wins, so concurrent sign-ups cannot both get through
+        user_id = await session.scalar(
+            dialect_insert(UserModel)
+            .values(email=user.email, email_canonical=canonical_email(user.email), password=hashed_password)
+            .on_conflict_do_nothing()
+            .returning(UserModel.id)
+        )
+        if user_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already exists"
+            )
 
-            verification_code = secrets.token_hex(3)
-            expiration_time = datetime.utcnow() + timedelta(minutes=15)
+        new_code = new_verification_code(user_id)
+        session.add(new_code)
+        await bump_stats(session, users=1, pending_codes=1)
 
-            new_code = VerificationCodeModel(user_id=user.id, code=verification_code, expires_at=expiration_time)
-            session.add(new_code)
-            session.commit()
+        # queued before the commit, a full mail queue rolls the sign-up back so the client can simply retry
+        send_verification_email(user.email, new_code.code)
+        await session.commit()
 
-            send_verification_email(user.email, verification_code)
+        audit_log.record("register", user.email, request)
 
-            return HTTPRequest(
-                status=201,
-                message="Please check your email for the verification code"
-            )
+        return HTTPRequest(
+            status=201,
+            message="Please check your email for the verification code"
+        )
 
-        except HTTPException as e:
-            raise HTTPException(
-                status_code=e.status_code,
-                detail=str(e.detail)
-            )
-
-        except Exception as e:
-            logger.error(f"Unexpected error during registration: {e}", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="An unexpected error occurred"
-            )
+    except HTTPException as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e.detail),
+            headers=e.headers
+        )
 
-@router.post('/verify-verification-code', response_model=Token)
-async def verify_verification_code(data: VerifyCodeResponse) -> Token:
+    except Exception as e:
+        logger.error(f"Unexpected error during registration: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.post('/verify-verification-code', response_model=Token, dependencies=[Depends(verify_rate_limit)])
+async def verify_verification_code(data: VerifyCodeResponse, request: Request, session: AsyncSession = Depends(get_session)) -> Token:
     try:
-        with Session(engine) as session:
-            user = session.query(UserModel).filter(UserModel.email == data.email).first()
-            if not user:
+        user_id = await consume_verification_code(session, data.email, data.code)
+        if user_id is None:
+            if not await session.scalar(select(UserModel.id).where(UserModel.email_canonical == canonical_email(data.email))):
                 raise HTTPException(status_code=404, detail="User not found")
 
-            verification = session.query(VerificationCodeModel).filter(
-                VerificationCodeModel.user_id == user.id,
-                VerificationCodeModel.code == data.code,
-                VerificationCodeModel.expires_at > datetime.utcnow()
-            ).first()
+            audit_log.record("verify_failed", data.email, request)
+            raise HTTPException(status_code=400, detail="Invalid or expired verification code")
 
-            if not verification:
-                raise HTTPException(status_code=400, detail="Invalid or expired verification code")
+        # only matches a first verification, so the verified counter is bumped exactly once per user
+        user = await session.scalar(
+            update(UserModel).where(UserModel.id == user_id, UserModel.is_verified == False).values(is_verified=True, row_version=UserModel.row_version + 1).returning(UserModel)
+        )
+        newly_verified = user is not None
+        if not newly_verified:
+            user = await session.get(UserModel, user_id)
 
-            user.is_verified = True
-            session.delete(verification)
-            session.commit()
+        await bump_stats(session, verified=int(newly_verified), pending_codes=-1)
+        refresh_token = issue_refresh_token(session, user.id)
+        await session.commit()
+        invalidate_principal(user.email)
+        audit_log.record("verify", user.email, request)
 
-            access_token = create_access_token(data={"sub": user.email})
+        access_token = create_access_token(data=get_token_claims(user))
 
-            return Token(access_token=access_token, token_type="bearer")
+        return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
 
     except HTTPException as e:
         raise e
@@ -96,141 +116,232 @@ async def verify_verification_code(data: VerifyCodeResponse) -> Token:
         logger.error(f"Unexpected error during user update: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
-@router.post('/login', response_model=Token)
-async def login_user(user: UserSchema) -> Token:
-    with Session(engine) as session:
-        try:
-            queryUser = session.query(UserModel).filter(UserModel.email == user.email).first()
+@router.post('/login', response_model=Token, dependencies=[Depends(login_rate_limit)])
+async def login_user(user: UserSchema, request: Request, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_session)) -> Token:
+    try:
+        queryUser = await session.scalar(select(UserModel).where(UserModel.email_canonical == canonical_email(user.email)))
 
-            if queryUser is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
+        if queryUser is None:
+            audit_log.record("login_failed", user.email, request, detail="unknown email")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
 
-            if not pwd_context.verify(user.password, queryUser.password):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
+        if not await check_password(user.password, queryUser.password):
+            audit_log.record("login_failed", queryUser.email, request, detail="wrong password")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        if needs_rehash(queryUser.password):
+            # upgraded after the response is sent, the login itself never waits on a second hash
+            background_tasks.add_task(rehash_password, queryUser.id, user.password, queryUser.password)
 
-            access_token = create_access_token(data={"sub": str(user.email)})
+        refresh_token = issue_refresh_token(session, queryUser.id)
+        await session.commit()
 
-            return Token(access_token=access_token, token_type="bearer")
+        access_token = create_access_token(data=get_token_claims(queryUser))
+        audit_log.record("login", queryUser.email, request)
 
-        except HTTPException as e:
-            raise e
+        return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        logger.error(f"Unexpected error during login: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.post('/token', response_model=Token, dependencies=[Depends(login_rate_limit)]) # route for FastAPI docs
+async def token(request: Request, background_tasks: BackgroundTasks, user: UserSchema = Depends(), session: AsyncSession = Depends(get_session)) -> Token:
+    try:
+        queryUser = await session.scalar(select(UserModel).where(UserModel.email_canonical == canonical_email(user.email)))
 
-        except Exception as e:
-            logger.error(f"Unexpected error during login: {e}", exc_info=True)
+        if queryUser is None:
+            audit_log.record("login_failed", user.email, request, detail="unknown email")
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="An unexpected error occurred"
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
             )
 
-@router.post('/token', response_model=Token) # route for FastAPI docs
-async def token(user: UserSchema = Depends()) -> Token:
-    with Session(engine) as session:
-        try:
-            queryUser = session.query(UserModel).filter(UserModel.email == user.email).first()
+        if not await check_password(user.password, queryUser.password):
+            audit_log.record("login_failed", queryUser.email, request, detail="wrong password")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
 
-            if queryUser is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
+        if needs_rehash(queryUser.password):
+            # upgraded after the response is sent, the login itself never waits on a second hash
+            background_tasks.add_task(rehash_password, queryUser.id, user.password, queryUser.password)
 
-            if not pwd_context.verify(user.password, queryUser.password):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
+        refresh_token = issue_refresh_token(session, queryUser.id)
+        await session.commit()
 
-            access_token = create_access_token(data={"sub": str(user.email)})
+        access_token = create_access_token(data=get_token_claims(queryUser))
+        audit_log.record("login", queryUser.email, request)
 
-            return Token(access_token=access_token, token_type="bearer")
+        return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
 
-        except HTTPException as e:
-            raise e
+    except HTTPException as e:
+        raise e
 
-        except Exception as e:
-            logger.error(f"Unexpected error during login: {e}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Unexpected error during login: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.post('/refresh', response_model=Token, dependencies=[Depends(login_rate_limit)])
+async def refresh_access_token(data: RefreshRequest, session: AsyncSession = Depends(get_session)) -> Token:
+    try:
+        rotated = await rotate_refresh_token(session, data.refresh_token)
+        if rotated is None:
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="An unexpected error occurred"
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired refresh token",
+                headers={"WWW-Authenticate": "Bearer"},
             )
 
-@router.get('/users/me')
-async def get_current_active_user(token: str = Depends(get_current_user)):
-    return token # returns user's email
+        user, refresh_token = rotated
+        access_token = create_access_token(data=get_token_claims(user))
 
-@router.get('/get-user-data', response_model=UserSchema)
-async def get_user_data(token: str = Depends(get_current_user)) -> UserSchema:
-    with Session(engine) as session:
-        try:
-            user = session.query(UserModel).filter(UserModel.email == token).first()
+        return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
 
-            if user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User not found",
-                )
+    except HTTPException as e:
+        raise e
 
-            return UserSchema(
-                email=user.email,
-                password=user.password
+    except Exception as e:
+        logger.error(f"Unexpected error during token refresh: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.post('/logout')
+async def logout(data: RefreshRequest | None = None, token: str = Depends(oauth2_scheme), email: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    try:
+        payload = decode_access_token(token)
+        if data is not None:
+            await session.execute(
+                update(RefreshTokenModel)
+                .where(RefreshTokenModel.token_hash == hash_refresh_token(data.refresh_token), RefreshTokenModel.revoked_at.is_(None))
+                .values(revoked_at=datetime.utcnow())
             )
+        await revoke_access_token(session, payload["jti"], payload["exp"])
+
+        return HTTPRequest(
+            status=200,
+            message="Logged out successfully"
+        )
 
-        except HTTPException as e:
-            raise e
+    except Exception as e:
+        logger.error(f"Unexpected error during logout: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.get('/users/me')
+async def get_current_active_user(request: Request, response: Response, principal: Principal = Depends(get_current_principal)):
+    if principal.row_version is not None:
+        etag = user_etag(principal.id, principal.row_version)
+        if etag_matches(request, etag):
+            return not_modified("users-me", etag)
+        modified("users-me", response, etag)
 
-        except Exception as e:
-            logger.error(f"Unexpected error while fetching user data: {e}", exc_info=True)
+    return principal.email # returns user's email
+
+@router.get('/get-user-data', response_model=UserSummary)
+async def get_user_data(request: Request, response: Response, principal: Principal = Depends(get_current_principal), session: AsyncSession = Depends(get_session)) -> UserSummary:
+    try:
+        # the principal carries the row version, so an unchanged poll is answered without reading the users row
+        if principal.row_version is not None and etag_matches(request, user_etag(principal.id, principal.row_version)):
+            return not_modified("get-user-data", user_etag(principal.id, principal.row_version))
+
+        user = (await session.execute(
+            select(*USER_SUMMARY_COLUMNS, UserModel.row_version).where(UserModel.email_canonical == canonical_email(principal.email))
+        )).first()
+
+        if user is None:
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="An unexpected error occurred while fetching user data"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found",
             )
 
+        etag = user_etag(user.id, user.row_version)
+        if etag_matches(request, etag):
+            return not_modified("get-user-data", etag)
+        modified("get-user-data", response, etag)
+
+        return UserSummary.model_validate(user)
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching user data: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while fetching user data"
+        )
+
 @router.put('/update-user', response_model=UserSchema)
-async def update_user_data(user_update: UserUpdate, token: str = Depends(get_current_user)) -> UserSchema:
+async def update_user_data(user_update: UserUpdate, token: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)) -> UserSchema:
     try:
-        with Session(engine) as session:
-            user = session.query(UserModel).filter(UserModel.email == token).first()
-            if not user:
-                raise HTTPException(
-                    status_code=404,
-                    detail="User not found"
-                )
-
-            if user_update.email:
-                existing_user = session.query(UserModel).filter(UserModel.email == user_update.email).first()
-                if existing_user and existing_user.id != user.id:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Email already taken"
-                    )
-                user.email = user_update.email
-
-            if user_update.password:
-                user.password = get_password_hash(user_update.password)
-
-            session.commit()
-            session.refresh(user)
-
-            updated_user = UserSchema(
-                email=user.email,
-                password="**********"
+        values = {}
+        if user_update.email:
+            values["email"] = user_update.email
+            values["email_canonical"] = canonical_email(user_update.email)
+        if user_update.password:
+            values["password"] = await hash_password(user_update.password)
+            # a new password ends every existing session, same as /update-password
+            values["token_version"] = UserModel.token_version + 1
+
+        if values:
+            values["row_version"] = UserModel.row_version + 1
+            query = update(UserModel).where(UserModel.email_canonical == canonical_email(token)).values(**values).returning(UserModel.id, UserModel.email, UserModel.token_version)
+        else:
+            query = select(UserModel.id, UserModel.email).where(UserModel.email_canonical == canonical_email(token))
+
+        try:
+            user = (await session.execute(query)).first()
+            if user is not None and user_update.password:
+                await revoke_refresh_tokens(session, user.id)
+                revoke_sessions(session, user.id, user.token_version)
+            await session.commit()
+        except IntegrityError:
+            # the unique index on email rejected the new address
+            await session.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail="Email already taken"
             )
 
-            return HTTPRequest(
-                status=201,
-                message=updated_user
+        if user is None:
+            raise HTTPException(
+                status_code=404,
+                detail="User not found"
             )
 
+        invalidate_principal(token)
+        invalidate_principal(user.email)
+
+        return UserSchema(
+            email=user.email,
+            password="**********"
+        )
+
     except HTTPException as e:
         raise e
 
@@ -238,63 +349,66 @@ async def update_user_data(user_update: UserUpdate, token: str = Depends(get_cur
         logger.error(f"Unexpected error during user update: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
-@router.post('/forgot-password')
-async def forgot_password(request: ForgotPasswordRequest):
+@router.post('/forgot-password', dependencies=[Depends(forgot_password_rate_limit)])
+async def forgot_password(request: ForgotPasswordRequest, session: AsyncSession = Depends(get_session)):
     email = request.email
-    with Session(engine) as session:
-        try:
-            user = session.query(UserModel).filter(UserModel.email == email).first()
-
-            if user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User not found"
-                )
+    try:
+        user = (await session.execute(
+            select(UserModel.id, UserModel.email).where(UserModel.email_canonical == canonical_email(email))
+        )).first()
 
-            verification_code = secrets.token_hex(3)
-            expiration_time = datetime.utcnow() + timedelta(minutes=15)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
 
-            new_code = VerificationCodeModel(user_id=user.id, code=verification_code, expires_at=expiration_time)
-            session.add(new_code)
-            session.commit()
+        # hand the connection back first, concurrent resends for one user all wait on a single issuance
+        await session.close()
 
-            response = send_verification_email(user.email, verification_code)
+        # reuses a recent code and honors the resend cooldown, repeated clicks do not each write a row and send a mail
+        response = await issue_verification_code(user.id, user.email)
 
-            return response
+        return response
 
-        except HTTPException as e:
-            raise e
+    except HTTPException as e:
+        raise e
 
-        except Exception as e:
-            logger.error(f"Unexpected error while fetching user data: {e}", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="An unexpected error occurred while fetching user data"
-            )
+    except Exception as e:
+        logger.error(f"Unexpected error while fetching user data: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while fetching user data"
+        )
 
 @router.post('/update-password')
-async def update_password(request: UpdatePasswordRequest, token: str = Depends(get_current_user)):
+async def update_password(request: UpdatePasswordRequest, token: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     password = request.password
     try:
-        with Session(engine) as session:
-            user = session.query(UserModel).filter(UserModel.email == token).first()
-            if not user:
-                raise HTTPException(
-                    status_code=404,
-                    detail="User not found"
-                )
-
-            if password:
-                user.password = get_password_hash(password)
-
-            session.commit()
-            session.refresh(user)
-
-            return HTTPRequest(
-                status=201,
-                message='User password updated successfully'
+        user = await session.scalar(select(UserModel).where(UserModel.email_canonical == canonical_email(token)))
+        if not user:
+            raise HTTPException(
+                status_code=404,
+                detail="User not found"
             )
 
+        if password:
+            user.password = await hash_password(password)
+            # a new password ends every existing session
+            user.token_version = (user.token_version or 0) + 1
+            user.row_version = (user.row_version or 0) + 1
+            await revoke_refresh_tokens(session, user.id)
+            revoke_sessions(session, user.id, user.token_version)
+
+        await session.commit()
+        await session.refresh(user)
+        invalidate_principal(token)
+
+        return HTTPRequest(
+            status=201,
+            message='User password updated successfully'
+        )
+
     except HTTPException as e:
         raise e
 
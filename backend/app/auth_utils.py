@@ -1,108 +1,116 @@
 import os
 import logging
-from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 import jwt
-from sqlalchemy.orm import Session
-from models import UserModel
-from database import engine
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import UserModel, canonical_email
+from database import get_session
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from schemas import HTTPRequest
+from schemas import HTTPRequest, Principal
+from cache import TTLCache
+from mailer import dispatcher, verification_message
+from revocation import denylist
+from tokens import token_service
 
 load_dotenv()
 
 logger = logging.getLogger("uvicorn")
 
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-HASHING_ALGORITHM = os.getenv("HASHING_ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 30))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", 10000))
+# skip the DB and trust uid/admin/verified claims; password changes and deletions still revoke issued tokens,
+# other workers see them after their next denylist sync, admin/verified changes wait for the token to expire
+JWT_TRUST_CLAIMS = os.getenv("JWT_TRUST_CLAIMS", "false").lower() == "true"
 
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+principal_cache = TTLCache(max_size=PRINCIPAL_CACHE_MAX_SIZE, ttl_seconds=PRINCIPAL_CACHE_TTL_SECONDS)
 
 def create_access_token(data: dict):
-    to_encode = data.copy()
-
-    expire = datetime.utcnow() + timedelta(minutes=int(ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    return token_service.sign(data)
+
+def decode_access_token(token: str) -> dict:
+    return token_service.verify(token)
+
+def get_token_claims(user: UserModel) -> dict:
+    return {
+        "sub": user.email,
+        "uid": user.id,
+        "admin": bool(user.is_admin),
+        "verified": bool(user.is_verified),
+        "tv": user.token_version or 0,
+    }
+
+def invalidate_principal(email: str | None = None):
+    # cached principals are per worker, other workers pick up changes once the TTL expires
+    if email is None:
+        principal_cache.clear()
+    else:
+        principal_cache.pop(canonical_email(email))
 
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=HASHING_ALGORITHM)
+def send_verification_email(email: str, code: str):
+    message = verification_message(email, code)
+
+    # delivery, retries and connection reuse happen in the background mail dispatcher;
+    # a real 503 lets callers roll back what they wrote and keeps the answer out of the idempotency cache
+    if not dispatcher.enqueue(message):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Error sending verification email",
+            headers={"Retry-After": "30"}
+        )
 
-    return encoded_jwt
+    return HTTPRequest(
+        status=200,
+        message="Verification email sent successfully"
+    )
 
-def send_verification_email(email: str, code: str):
-    smtp_server = "smtp.gmail.com"
-    port = 587  # For starttls
-    sender_email = EMAIL_USER
-    password = EMAIL_PASSWORD
-
-    message = MIMEMultipart("alternative")
-    message["Subject"] = "Your Verification Code"
-    message["From"] = sender_email
-    message["To"] = email
-
-    text = f"Your verification code is: {code}"
-    html = f"""\
-    <html>
-      <body>
-        <p>Your verification code is: <strong>{code}</strong></p>
-      </body>
-    </html>
-    """
-
-    part1 = MIMEText(text, "plain")
-    part2 = MIMEText(html, "html")
-
-    message.attach(part1)
-    message.attach(part2)
+async def get_current_principal(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> Principal:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
     try:
-        with smtplib.SMTP(smtp_server, port) as server:
-            server.starttls()
-            server.login(sender_email, password)
-            server.sendmail(sender_email, email, message.as_string())
-
-            return HTTPRequest(
-                status=200,
-                message="Verification email sent successfully"
-            )
-
-    except Exception as e:
-        logger.warning(f"Error sending email: {str(e)}")
-        return HTTPRequest(
-            status=500,
-            message="Error sending verification email"
-        )
+        payload = decode_access_token(token)
+    except jwt.PyJWTError:
+        raise credentials_exception
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    with Session(engine) as session:
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+    email: str = payload.get("sub")
+    if email is None or payload.get("jti") in denylist:
+        raise credentials_exception
+
+    if JWT_TRUST_CLAIMS and "uid" in payload:
+        # the users row is not read here, so the token version is checked against the synced revocations instead
+        if denylist.is_revoked_session(payload["uid"], payload.get("tv", 0)):
+            raise credentials_exception
+        return Principal(
+            id=payload["uid"],
+            email=email,
+            is_admin=payload.get("admin", False),
+            is_verified=payload.get("verified", False),
+            token_version=payload.get("tv", 0)
         )
 
-        try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[HASHING_ALGORITHM])
-            email: str = payload.get("sub")
-            if email is None:
-                raise credentials_exception
-            user = session.query(UserModel).filter(UserModel.email == email).first()
-            if user is None:
-                raise credentials_exception
-        except jwt.PyJWTError:
+    principal = principal_cache.get(canonical_email(email))
+    if principal is None:
+        row = (await session.execute(
+            select(UserModel.id, UserModel.email, UserModel.is_admin, UserModel.is_verified, UserModel.token_version, UserModel.row_version).where(UserModel.email_canonical == canonical_email(email))
+        )).first()
+        if row is None:
             raise credentials_exception
 
-        return email
\ No newline at end of file
+        principal = Principal(id=row.id, email=row.email, is_admin=bool(row.is_admin), is_verified=bool(row.is_verified), token_version=row.token_version, row_version=row.row_version)
+        principal_cache.set(canonical_email(email), principal)
+
+    # tokens issued before the last password change or logout-everywhere carry an older version
+    if payload.get("tv", 0) != principal.token_version:
+        raise credentials_exception
+
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal.email
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import sys
+import logging
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text, inspect, select, update, bindparam
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateColumn
+import models
+import settings
+from models import UserModel, canonical_email
+
+logger = logging.getLogger("uvicorn")
+
+BOOTSTRAP_LOCK_ID = 7300117 # arbitrary, shared by every replica running bootstrap against the same database
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 5000))
+
+# indexes no model declares any more, dropped so inserts stop maintaining them
+RETIRED_INDEXES = {"users": ("ix_users_email_lower", "ix_users_email_trgm")} # search moved to email_canonical
+
+# not the app's engine: index builds and backfills on a large table (and waiting on the advisory lock) run far
+# past DB_STATEMENT_TIMEOUT_MS, and unpooled connections mean nothing of this one-off step lingers in a worker
+engine = create_engine(settings.DATABASE_URL, poolclass=NullPool)
+
+@contextmanager
+def bootstrap_lock():
+    # serializes one-time initialization across processes and hosts, the second caller waits and then finds nothing to do
+    with engine.connect() as connection:
+        if connection.dialect.name != "postgresql":
+            yield connection
+            return
+
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": BOOTSTRAP_LOCK_ID})
+        try:
+            yield connection
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": BOOTSTRAP_LOCK_ID})
+
+def add_missing_columns(connection):
+    # create_all skips tables that already exist, so columns added to a model later are created here
+    inspector = inspect(connection)
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=connection.dialect)}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+def existing_index_names(connection, table: str) -> set:
+    if connection.dialect.name == "sqlite":
+        # SQLite reflection skips expression indexes such as lower(email), the catalog lists every one
+        return set(connection.scalars(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {"table": table}))
+    return {index["name"] for index in inspect(connection).get_indexes(table)}
+
+def drop_retired_indexes(connection):
+    for table, names in RETIRED_INDEXES.items():
+        existing = existing_index_names(connection, table)
+        for name in names:
+            if name in existing:
+                connection.execute(text(f"DROP INDEX {name}"))
+                logger.info(f"Dropped index {name}")
+
+def create_missing_indexes(connection):
+    for table in models.Base.metadata.sorted_tables:
+        existing = existing_index_names(connection, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection) # honors ddl_if, so Postgres-only indexes are a no-op elsewhere
+                if index.name in existing_index_names(connection, table.name):
+                    logger.info(f"Created index {index.name}")
+
+def backfill_canonical_emails(connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    users = UserModel.__table__
+    set_canonical = update(users).where(users.c.id == bindparam("user_id")).values(email_canonical=bindparam("canonical"))
+
+    updated = 0
+    last_id = 0
+    conflicts = []
+    while True:
+        rows = connection.execute(
+            select(users.c.id, users.c.email)
+            .where(users.c.email_canonical.is_(None), users.c.id > last_id)
+            .order_by(users.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        wanted = {row.id: canonical_email(row.email) for row in rows if row.email}
+        taken = set(connection.scalars(select(users.c.email_canonical).where(users.c.email_canonical.in_(set(wanted.values())))))
+
+        batch = []
+        for user_id, canonical in wanted.items():
+            if canonical in taken:
+                # an older account already owns this address in another case, the duplicate has to be merged by hand
+                conflicts.append(user_id)
+                continue
+            taken.add(canonical)
+            batch.append({"user_id": user_id, "canonical": canonical})
+
+        if batch:
+            connection.execute(set_canonical, batch)
+        connection.commit()
+        updated += len(batch)
+
+    if conflicts:
+        logger.warning(f"{len(conflicts)} users collide with an older account after normalizing their email and cannot log in until merged: ids {conflicts[:50]}")
+    return updated
+
+def create_schema():
+    with bootstrap_lock() as connection:
+        models.Base.metadata.create_all(bind=connection) # only creates missing tables and indexes
+        add_missing_columns(connection)
+        connection.commit()
+
+        backfilled = backfill_canonical_emails(connection)
+        if backfilled:
+            logger.info(f"Backfilled canonical emails for {backfilled} users")
+
+        # built after the backfill so the new indexes are created once instead of updated row by row
+        drop_retired_indexes(connection)
+        create_missing_indexes(connection)
+        connection.commit()
+
+def reset_schema():
+    with bootstrap_lock() as connection:
+        models.Base.metadata.drop_all(bind=connection) # deletes all
+        models.Base.metadata.create_all(bind=connection)
+        connection.commit()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--reset" in sys.argv:
+        reset_schema()
+        logger.warning("Dropped and recreated all tables")
+    else:
+        create_schema()
+        logger.info("Schema is up to date")
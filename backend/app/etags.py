@@ -0,0 +1,32 @@
+from fastapi import Request, Response
+from metrics import Counter, register
+
+conditional_requests = register(Counter("conditional_requests_total", "Polled reads answered with 304 or a full body", ("route", "outcome")))
+
+def user_etag(user_id: int, row_version: int) -> str:
+    # strong validator: row_version is bumped in the same UPDATE as every change to what these endpoints return
+    return f'"u{user_id}.v{row_version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    value = request.headers.get("if-none-match")
+    if not value:
+        return False
+    if value.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches
+    return etag in (tag.strip().removeprefix("W/") for tag in value.split(","))
+
+def set_etag(response: Response, etag: str):
+    # private: the body belongs to the bearer; no-cache: the browser keeps it but revalidates on every poll
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def not_modified(route: str, etag: str) -> Response:
+    conditional_requests.inc(route=route, outcome="not_modified")
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
+
+def modified(route: str, response: Response, etag: str):
+    conditional_requests.inc(route=route, outcome="full")
+    set_etag(response, etag)
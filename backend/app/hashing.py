@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from passlib.hash import argon2
+from sqlalchemy import update
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import UserModel
+from metrics import Gauge, register, observe_phase
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread") # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+PASSWORD_HASH_BULK_WORKERS = int(os.getenv("PASSWORD_HASH_BULK_WORKERS", max(1, PASSWORD_HASH_WORKERS // 2)))
+
+ARGON2_TIME_COST = os.getenv("ARGON2_TIME_COST") # fixes the time cost and skips calibration
+ARGON2_MIN_TIME_COST = int(os.getenv("ARGON2_MIN_TIME_COST", 2))
+ARGON2_MAX_TIME_COST = int(os.getenv("ARGON2_MAX_TIME_COST", 10))
+ARGON2_MEMORY_COST_KIB = int(os.getenv("ARGON2_MEMORY_COST_KIB", 65536))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", 250))
+PASSWORD_HASH_MEMORY_BUDGET_MB = int(os.getenv("PASSWORD_HASH_MEMORY_BUDGET_MB", 1024))
+
+def capped_memory_cost(memory_cost: int, workers: int, budget_mb: int) -> int:
+    # every pool worker may run one Argon2 call at a time, so the pool needs memory_cost * workers at peak
+    cap = budget_mb * 1024 // workers
+    if memory_cost > cap:
+        logger.warning(f"Capping Argon2 memory cost at {cap} KiB so {workers} workers fit in {budget_mb} MB")
+        memory_cost = cap
+    return max(8 * ARGON2_PARALLELISM, memory_cost)
+
+parameters = {
+    "time_cost": int(ARGON2_TIME_COST or 3),
+    "memory_cost": capped_memory_cost(ARGON2_MEMORY_COST_KIB, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MEMORY_BUDGET_MB),
+    "parallelism": ARGON2_PARALLELISM,
+}
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=parameters["time_cost"],
+    argon2__memory_cost=parameters["memory_cost"],
+    argon2__parallelism=parameters["parallelism"],
+)
+
+def configure_context(time_cost: int, memory_cost: int, parallelism: int):
+    # also the process pool initializer, so worker processes hash with the parent's calibrated parameters
+    pwd_context.update(argon2__rounds=time_cost, argon2__memory_cost=memory_cost, argon2__parallelism=parallelism)
+    parameters.update(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def measure_hash(time_cost: int, memory_cost: int, parallelism: int, samples: int = 3) -> float:
+    handler = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.hash("calibration-password")
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+def calibrate(target_ms: float = PASSWORD_HASH_TARGET_MS, memory_cost: int | None = None, parallelism: int = ARGON2_PARALLELISM) -> list:
+    # raises the time cost until one hash takes at least target_ms on this host, memory stays at the capped value
+    memory_cost = memory_cost or parameters["memory_cost"]
+    report = []
+    for time_cost in range(ARGON2_MIN_TIME_COST, ARGON2_MAX_TIME_COST + 1):
+        median_ms = measure_hash(time_cost, memory_cost, parallelism) * 1000
+        report.append({"time_cost": time_cost, "memory_cost_kib": memory_cost, "parallelism": parallelism, "median_ms": median_ms})
+        if median_ms >= target_ms:
+            break
+    return report
+
+def configure_hashing():
+    # read again rather than from the import-time value, serve.py may have exported it after calibrating
+    fixed_time_cost = os.getenv("ARGON2_TIME_COST")
+    if fixed_time_cost:
+        time_cost = int(fixed_time_cost)
+    else:
+        report = calibrate()
+        time_cost = report[-1]["time_cost"]
+        logger.info(f"Calibrated Argon2 time cost {time_cost} ({report[-1]['median_ms']:.0f}ms, target {PASSWORD_HASH_TARGET_MS:.0f}ms)")
+
+    configure_context(time_cost, parameters["memory_cost"], parameters["parallelism"])
+
+def needs_rehash(hashed_password: str) -> bool:
+    if not argon2.identify(hashed_password):
+        return True
+
+    # replicas calibrate independently and can land a step apart, so only upgrade hashes that are
+    # cheaper than ours instead of rewriting on any difference and flipping back and forth
+    current = argon2.from_string(hashed_password)
+    return current.rounds * current.memory_cost < parameters["time_cost"] * parameters["memory_cost"]
+
+class HashingMetrics:
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.operations = {}
+
+    def _operation(self, operation: str):
+        if operation not in self.operations:
+            self.operations[operation] = {
+                "count": 0,
+                "rejected": 0,
+                "total_seconds": 0.0,
+                "max_seconds": 0.0,
+                "recent": deque(maxlen=self.window),
+            }
+        return self.operations[operation]
+
+    def observe(self, operation: str, seconds: float):
+        stats = self._operation(operation)
+        stats["count"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["recent"].append(seconds)
+
+    def reject(self, operation: str):
+        self._operation(operation)["rejected"] += 1
+
+    def snapshot(self):
+        result = {}
+        for operation, stats in self.operations.items():
+            recent = sorted(stats["recent"])
+            result[operation] = {
+                "count": stats["count"],
+                "rejected": stats["rejected"],
+                "mean_ms": (stats["total_seconds"] / stats["count"] * 1000) if stats["count"] else 0.0,
+                "max_ms": stats["max_seconds"] * 1000,
+                "p50_ms": _percentile(recent, 0.50) * 1000,
+                "p95_ms": _percentile(recent, 0.95) * 1000,
+                "p99_ms": _percentile(recent, 0.99) * 1000,
+            }
+        return result
+
+def _percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+metrics = HashingMetrics()
+
+_executor = None
+_pending = 0
+_bulk_slots = None
+_rehashed = 0
+
+register(Gauge("password_hash_pending", "Hash/verify calls queued or running on the pool", callback=lambda: _pending))
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                initializer=configure_context,
+                initargs=(parameters["time_cost"], parameters["memory_cost"], parameters["parallelism"])
+            )
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="argon2")
+        logger.info(f"Started password hashing {PASSWORD_HASH_EXECUTOR} pool with {PASSWORD_HASH_WORKERS} workers")
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+def get_hashing_stats():
+    return {
+        "executor": PASSWORD_HASH_EXECUTOR,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": _pending,
+        "parameters": parameters,
+        "rehashed": _rehashed,
+        "operations": metrics.snapshot(),
+    }
+
+async def _run_in_pool(operation: str, func, *args):
+    # the event loop is single threaded, so the check and increment below cannot race
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        metrics.reject(operation)
+        logger.warning(f"Password hashing pool saturated, rejecting {operation} ({_pending} pending)")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"}
+        )
+
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _pending -= 1
+        elapsed = time.perf_counter() - start
+        metrics.observe(operation, elapsed)
+        observe_phase("argon2", elapsed)
+
+async def hash_password(password: str) -> str:
+    return await _run_in_pool("hash", get_password_hash, password)
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_pool("verify", verify_password, plain_password, hashed_password)
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    # bulk jobs are not shed, but only use part of the pool so interactive logins keep a free worker
+    global _bulk_slots
+    if _bulk_slots is None:
+        _bulk_slots = asyncio.Semaphore(PASSWORD_HASH_BULK_WORKERS)
+
+    loop = asyncio.get_running_loop()
+
+    async def hash_one(password: str) -> str:
+        async with _bulk_slots:
+            start = time.perf_counter()
+            try:
+                return await loop.run_in_executor(get_executor(), get_password_hash, password)
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.observe("bulk_hash", elapsed)
+                observe_phase("argon2", elapsed)
+
+    return list(await asyncio.gather(*(hash_one(password) for password in passwords)))
+
+async def rehash_password(user_id: int, password: str, old_hash: str):
+    # runs as a background task after the login response, on the bulk slots so it never sheds a login
+    global _rehashed
+    try:
+        new_hash, = await hash_passwords([password])
+        async with AsyncSessionLocal() as session:
+            # matching on the old hash skips users who changed their password in the meantime
+            await session.execute(
+                update(UserModel)
+                .where(UserModel.id == user_id, UserModel.password == old_hash)
+                .values(password=new_hash)
+            )
+            await session.commit()
+        _rehashed += 1
+    except Exception as e:
+        logger.warning(f"Could not rehash password for user {user_id}: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--calibrate" in sys.argv:
+        print(f"Target {PASSWORD_HASH_TARGET_MS:.0f}ms per hash, {PASSWORD_HASH_WORKERS} workers, {PASSWORD_HASH_MEMORY_BUDGET_MB} MB budget")
+        print(f"{'time_cost':>10}{'memory KiB':>12}{'parallelism':>13}{'median ms':>11}")
+        report = calibrate()
+        for row in report:
+            print(f"{row['time_cost']:>10}{row['memory_cost_kib']:>12}{row['parallelism']:>13}{row['median_ms']:>11.1f}")
+        chosen = report[-1]
+        print(f"Suggested: ARGON2_TIME_COST={chosen['time_cost']} ARGON2_MEMORY_COST_KIB={chosen['memory_cost_kib']}")
+        print(f"Peak Argon2 memory with a full pool: {chosen['memory_cost_kib'] * PASSWORD_HASH_WORKERS // 1024} MB")
+    else:
+        print("usage: python hashing.py --calibrate")
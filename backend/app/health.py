@@ -0,0 +1,90 @@
+import os
+import asyncio
+import logging
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+from dotenv import load_dotenv
+from database import async_engine
+from mailer import dispatcher
+from hashing import get_hashing_stats
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+READINESS_MAX_POOL_SATURATION = float(os.getenv("READINESS_MAX_POOL_SATURATION", 0.9))
+READINESS_DB_TIMEOUT_SECONDS = float(os.getenv("READINESS_DB_TIMEOUT_SECONDS", 2))
+
+router = APIRouter()
+
+# flipped by the lifespan: ready once the pool is warm, back to draining when shutdown starts
+state = {"ready": False, "draining": False}
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"type": type(pool).__name__}
+
+    capacity = pool.size() + max(0, getattr(pool, "_max_overflow", 0))
+    checked_out = pool.checkedout()
+    return {
+        "type": type(pool).__name__,
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "saturation": checked_out / capacity if capacity else 0.0,
+    }
+
+async def warm_pool(engine, connections: int):
+    # open the connections concurrently so the first requests do not pay for TCP/TLS/auth setup
+    async def ping():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+async def ping_database():
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+async def check_database() -> str | None:
+    try:
+        await asyncio.wait_for(ping_database(), timeout=READINESS_DB_TIMEOUT_SECONDS)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+@router.get('/healthz')
+async def healthz():
+    # liveness only: the process is up and the event loop answers, dependencies are /readyz's job
+    return {"status": "ok", "draining": state["draining"]}
+
+@router.get('/readyz')
+async def readyz():
+    pool = pool_status(async_engine)
+    hashing = get_hashing_stats()
+    problems = []
+
+    if state["draining"]:
+        problems.append("shutting down")
+    elif not state["ready"]:
+        problems.append("starting up")
+
+    if pool.get("saturation", 0.0) >= READINESS_MAX_POOL_SATURATION:
+        problems.append(f"database pool {pool['checked_out']}/{pool['capacity']} checked out")
+    elif not problems:
+        # only ping when a connection is likely free, a saturated pool would just queue the probe
+        error = await check_database()
+        if error:
+            problems.append(f"database unreachable ({error})")
+
+    body = {
+        "status": "ready" if not problems else "unavailable",
+        "problems": problems,
+        "database_pool": pool,
+        "mail_queue_depth": dispatcher.queue.qsize(),
+        "password_hash_pending": hashing["pending"],
+    }
+    return ORJSONResponse(body, status_code=200 if not problems else 503)
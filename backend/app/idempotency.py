@@ -0,0 +1,155 @@
+import os
+import asyncio
+import hashlib
+import logging
+import orjson
+from dotenv import load_dotenv
+from cache import TTLCache
+from metrics import Counter, register
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 86400))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 30)) # how long a duplicate waits for the original to finish
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", 65536)) # larger responses are passed through uncached
+
+# (method, path) pairs that honor the Idempotency-Key header
+IDEMPOTENT_ROUTES = {
+    ("POST", "/api/auth/register"),
+    ("POST", "/api/auth/forgot-password"),
+    ("PUT", "/api/auth/update-user"),
+    ("GET", "/api/admin/create-user"),
+}
+
+idempotency_requests = register(Counter("idempotency_requests_total", "Requests carrying an Idempotency-Key by outcome", ("outcome",)))
+
+def header(scope, name: bytes) -> bytes | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return b"".join(chunks)
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+def replay_body(body: bytes, receive):
+    # the body was consumed to fingerprint it, the app gets it again in one piece
+    delivered = False
+
+    async def receive_again():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return receive_again
+
+def is_retryable(response: dict) -> bool:
+    # server errors, throttling and anything carrying Retry-After are worth retrying for real
+    if response["status"] >= 500 or response["status"] == 429:
+        return True
+    if any(key.lower() == b"retry-after" for key, _ in response["headers"]):
+        return True
+
+    # older handlers report failures as HTTPRequest bodies ({"status": 503, ...}) on an HTTP 200
+    if any(key.lower() == b"content-type" and value.startswith(b"application/json") for key, value in response["headers"]):
+        try:
+            body = orjson.loads(b"".join(response["body"]))
+        except orjson.JSONDecodeError:
+            return False
+        embedded = body.get("status") if isinstance(body, dict) else None
+        return isinstance(embedded, int) and (embedded >= 500 or embedded == 429)
+
+    return False
+
+async def send_json(send, status: int, body: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    def __init__(self, app, routes: set = IDEMPOTENT_ROUTES, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.app = app
+        self.routes = routes
+        # holds an asyncio.Future while the first request runs and the captured response afterwards
+        self.responses = TTLCache(max_size=max_keys, ttl_seconds=ttl_seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            return await self.app(scope, receive, send)
+
+        key = header(scope, b"idempotency-key")
+        if key is None:
+            return await self.app(scope, receive, send)
+
+        if not 0 < len(key) <= 255:
+            return await send_json(send, 400, b'{"detail":"Idempotency-Key must be 1 to 255 characters"}')
+
+        # scoped to the caller, so one user's key can never replay another user's response
+        authorization = hashlib.sha256(header(scope, b"authorization") or b"").hexdigest()
+        cache_key = (scope["method"], scope["path"], authorization, key)
+
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        while True:
+            entry = self.responses.get(cache_key)
+            if entry is None:
+                break
+
+            if isinstance(entry, asyncio.Future):
+                idempotency_requests.inc(outcome="waited")
+                try:
+                    await asyncio.wait_for(asyncio.shield(entry), timeout=IDEMPOTENCY_WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    return await send_json(send, 409, b'{"detail":"A request with this Idempotency-Key is still being processed"}')
+                # finished: replay what it stored, or run ourselves if it was not cacheable
+                continue
+
+            if entry["fingerprint"] != fingerprint:
+                idempotency_requests.inc(outcome="mismatch")
+                return await send_json(send, 422, b'{"detail":"Idempotency-Key was already used with a different request body"}')
+
+            idempotency_requests.inc(outcome="replayed")
+            await send({"type": "http.response.start", "status": entry["status"], "headers": [*entry["headers"], (b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": entry["body"]})
+            return
+
+        idempotency_requests.inc(outcome="executed")
+        in_flight = asyncio.get_running_loop().create_future()
+        self.responses.set(cache_key, in_flight)
+
+        response = {"status": 500, "headers": [], "body": [], "size": 0}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+                if response["size"] <= IDEMPOTENCY_MAX_BODY_BYTES:
+                    response["body"].append(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, replay_body(body, receive), capture)
+            # everything that is not retryable is the answer to this key
+            if response["size"] <= IDEMPOTENCY_MAX_BODY_BYTES and not is_retryable(response):
+                stored = {"fingerprint": fingerprint, "status": response["status"], "headers": response["headers"], "body": b"".join(response["body"])}
+        finally:
+            if stored is not None:
+                self.responses.set(cache_key, stored)
+            elif self.responses.get(cache_key) is in_flight:
+                self.responses.pop(cache_key)
+            in_flight.set_result(None)
@@ -0,0 +1,237 @@
+import os
+import time
+import asyncio
+import logging
+import smtplib
+from email.message import Message
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+from metrics import Counter, Gauge, register, observe_phase
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "smtp") # "smtp" or "memory"
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_IDLE_TIMEOUT_SECONDS = float(os.getenv("SMTP_IDLE_TIMEOUT_SECONDS", 30))
+MAIL_QUEUE_MAX_SIZE = int(os.getenv("MAIL_QUEUE_MAX_SIZE", 10000))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 5))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", 1))
+
+emails_sent = register(Counter("emails_total", "Outbound emails by outcome", ("outcome",)))
+
+class SMTPTransport:
+    def __init__(self, host: str, port: int, username: str | None, password: str | None, starttls: bool = True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port)
+        if self.starttls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        return server
+
+    def _send(self, message: Message):
+        reused = self._server is not None
+        if not reused:
+            self._server = self._connect()
+
+        try:
+            self._server.sendmail(message["From"], [message["To"]], message.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # no NOOP before every message: a pooled connection the server has dropped shows up here,
+            # and is replaced once; a fresh connection failing the same way is a real error
+            self.close()
+            if not reused:
+                raise
+            self._server = self._connect()
+            self._server.sendmail(message["From"], [message["To"]], message.as_string())
+
+    def send_batch(self, messages: list) -> list:
+        # one STARTTLS/login per connection, every message in the batch reuses it
+        errors = []
+        for message in messages:
+            try:
+                self._send(message)
+                errors.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                # a refused recipient leaves the session usable, anything else may not
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.close()
+                errors.append(e)
+
+        return errors
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+def is_permanent(error: Exception) -> bool:
+    # 5xx replies (unknown mailbox, rejected content) fail the same way on every attempt, 4xx and network errors may not
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+class MemoryTransport:
+    def __init__(self):
+        self.messages = []
+
+    def send_batch(self, messages: list) -> list:
+        self.messages.extend(messages)
+        return [None] * len(messages)
+
+    def close(self):
+        pass
+
+class MailDispatcher:
+    def __init__(self, transport, max_size: int = MAIL_QUEUE_MAX_SIZE, batch_size: int = MAIL_BATCH_SIZE):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "rejected": 0, "batches": 0}
+        self._worker = None
+        self._retries = {} # backoff task -> (message, next attempt)
+        self._stopping = False
+
+    def enqueue(self, message: Message, attempt: int = 1) -> bool:
+        try:
+            self.queue.put_nowait((message, attempt))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            logger.warning(f"Mail queue full, dropping email to {message['To']}")
+            return False
+
+        self.stats["queued"] += 1
+        return True
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        # emails waiting out a retry backoff are sent now rather than cancelled with their timers
+        self._stopping = True
+        for task, (message, attempt) in list(self._retries.items()):
+            task.cancel()
+            self.enqueue(message, attempt)
+        self._retries.clear()
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            unsent = []
+            while not self.queue.empty():
+                message, _ = self.queue.get_nowait()
+                self.queue.task_done()
+                unsent.append(message["To"])
+            logger.warning(f"Mail queue not drained on shutdown, {len(unsent)} emails left unsent: {unsent[:50]}")
+
+        if self._worker is not None:
+            self._worker.cancel()
+        self._worker = None
+        self._stopping = False
+        await asyncio.to_thread(self.transport.close)
+
+    async def _run(self):
+        while True:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout=SMTP_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(self.transport.close)
+                continue
+
+            batch = [item]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            try:
+                errors = await asyncio.to_thread(self.transport.send_batch, [message for message, _ in batch])
+            except Exception as e:
+                errors = [e] * len(batch)
+            observe_phase("smtp", time.perf_counter() - start)
+
+            self.stats["batches"] += 1
+            for (message, attempt), error in zip(batch, errors):
+                if error is None:
+                    self.stats["sent"] += 1
+                    emails_sent.inc(outcome="sent")
+                else:
+                    self._retry(message, attempt, error)
+                self.queue.task_done()
+
+    def _retry(self, message: Message, attempt: int, error: Exception):
+        if is_permanent(error):
+            self.stats["failed"] += 1
+            emails_sent.inc(outcome="failed")
+            logger.error(f"Email to {message['To']} permanently rejected, not retrying: {error}")
+            return
+
+        if attempt >= MAIL_MAX_ATTEMPTS:
+            self.stats["failed"] += 1
+            emails_sent.inc(outcome="failed")
+            logger.error(f"Giving up on email to {message['To']} after {attempt} attempts: {error}")
+            return
+
+        self.stats["retried"] += 1
+        emails_sent.inc(outcome="retried")
+        if self._stopping:
+            # shutting down: no backoff, the drain timeout bounds how long the retries may take
+            self.enqueue(message, attempt + 1)
+            return
+
+        delay = MAIL_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+        logger.warning(f"Error sending email to {message['To']} (attempt {attempt}), retrying in {delay}s: {error}")
+        task = asyncio.create_task(self._requeue(message, attempt + 1, delay))
+        self._retries[task] = (message, attempt + 1)
+        task.add_done_callback(lambda task: self._retries.pop(task, None))
+
+    async def _requeue(self, message: Message, attempt: int, delay: float):
+        await asyncio.sleep(delay)
+        self.enqueue(message, attempt)
+
+def verification_message(email: str, code: str) -> Message:
+    message = MIMEMultipart("alternative")
+    message["Subject"] = "Your Verification Code"
+    message["From"] = EMAIL_USER
+    message["To"] = email
+
+    text = f"Your verification code is: {code}"
+    html = f"""\
+    <html>
+      <body>
+        <p>Your verification code is: <strong>{code}</strong></p>
+      </body>
+    </html>
+    """
+
+    message.attach(MIMEText(text, "plain"))
+    message.attach(MIMEText(html, "html"))
+    return message
+
+def create_transport():
+    if EMAIL_TRANSPORT == "memory":
+        return MemoryTransport()
+    return SMTPTransport(SMTP_HOST, SMTP_PORT, EMAIL_USER, EMAIL_PASSWORD, starttls=SMTP_STARTTLS)
+
+dispatcher = MailDispatcher(create_transport())
+
+register(Gauge("mail_queue_depth", "Emails waiting in the outbound queue", callback=lambda: dispatcher.queue.qsize()))
@@ -1,25 +1,76 @@
 import logging
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
-import models
-from database import engine
+from fastapi.responses import PlainTextResponse, ORJSONResponse
+import settings
+from database import engine, async_engine
+from health import router as health_router, state as health_state, warm_pool
 from auth import router as auth_router
 from admin import router as admin_router
+from hashing import configure_hashing, shutdown_executor
+from mailer import dispatcher
+from audit import audit_log
+from verification_codes import run_code_sweeper
+from revocation import run_denylist_sync
+from search import run_domain_stats_refresh
+from stats import run_stats_reconciler
+from metrics import MetricsMiddleware, instrument_engine, render_metrics
+from profiling import ProfilingMiddleware, profiler
+from idempotency import IdempotencyMiddleware
+from tokens import token_service
 
 logger = logging.getLogger("uvicorn")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(configure_hashing)
+    dispatcher.start()
+    audit_log.start()
+    code_sweeper = asyncio.create_task(run_code_sweeper())
+    denylist_sync = asyncio.create_task(run_denylist_sync())
+    domain_stats_refresh = asyncio.create_task(run_domain_stats_refresh())
+    stats_reconciler = asyncio.create_task(run_stats_reconciler())
+
+    try:
+        await warm_pool(async_engine, settings.DB_POOL_WARM_CONNECTIONS)
+    except Exception as e:
+        # stay up and let /readyz report the database until it is reachable
+        logger.error(f"Could not warm the database pool: {e}")
+    health_state["ready"] = True
+
+    yield
+
+    # uvicorn has stopped accepting requests and finished the in-flight ones by the time we get here
+    health_state["ready"] = False
+    health_state["draining"] = True
+    profiler.stop()
+    stats_reconciler.cancel()
+    domain_stats_refresh.cancel()
+    denylist_sync.cancel()
+    code_sweeper.cancel()
+    await dispatcher.stop(timeout=settings.MAIL_DRAIN_TIMEOUT_SECONDS)
+    await audit_log.stop() # writes whatever is still buffered
+    shutdown_executor()
+    await async_engine.dispose()
+    engine.dispose()
+
+# orjson serializes the large admin listings several times faster than the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(auth_router, prefix='/api/auth', tags=['authentication'])
 app.include_router(admin_router, prefix='/api/admin', tags=['administrator'])
+app.include_router(health_router, tags=['health'])
 
-# resets database table data
-models.Base.metadata.drop_all(bind=engine) # deletes all
-models.Base.metadata.create_all(bind=engine) # creates all
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+app.add_middleware(IdempotencyMiddleware) # innermost, so replays still show up in metrics
+app.add_middleware(ProfilingMiddleware, profiler=profiler) # inside MetricsMiddleware so it can read the request's phase timings
+app.add_middleware(MetricsMiddleware)
 
-environment = "dev"
-if environment == "dev":
+# schema is managed by `python bootstrap.py` (or serve.py on start), not at import, so restarts keep data and workers boot fast
+if settings.ENVIRONMENT == "dev":
     logger.warning("Running in development mode - allowing CORS for all origins")
     app.add_middleware(
         CORSMiddleware,
@@ -33,5 +84,10 @@ if environment == "dev":
 def index():
     return {"message": "Hello world!"}
 
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+@app.get('/.well-known/jwks.json')
+def jwks():
+    return token_service.jwks()
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 1000))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# per-request accumulator of phase timings, set by MetricsMiddleware
+request_phases: ContextVar[dict | None] = ContextVar("request_phases", default=None)
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def render(self) -> list:
+        value = self.callback() if self.callback else self.value
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            bucket_labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+registry = []
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+http_requests = register(Counter("http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")))
+http_request_seconds = register(Histogram("http_request_duration_seconds", "HTTP request latency by route", ("route", "method")))
+http_in_flight = register(Gauge("http_requests_in_flight", "HTTP requests currently being served"))
+db_queries_per_request = register(Histogram("db_queries_per_request", "SQL statements executed per HTTP request", ("route",), buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21)))
+phase_seconds = register(Histogram("phase_duration_seconds", "Time spent per phase (db, argon2, smtp)", ("phase",)))
+
+def observe_phase(phase: str, seconds: float):
+    phase_seconds.observe(seconds, phase=phase)
+    phases = request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+        phases[f"{phase}_count"] = phases.get(f"{phase}_count", 0) + 1
+
+def instrument_engine(engine):
+    # the start time lives on the statement's execution context, not on the connection: a statement that fails
+    # never reaches after_cursor_execute, and whatever it left behind dies with its context
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        observe_phase("db", time.perf_counter() - context._metrics_query_start)
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        phases = {}
+        token = request_phases.set(phases)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            request_phases.reset(token)
+
+            route = scope["route"].path if "route" in scope else "unmatched"
+            method = scope["method"]
+            http_requests.inc(route=route, method=method, status=status_code)
+            http_request_seconds.observe(elapsed, route=route, method=method)
+            db_queries_per_request.observe(phases.get("db_count", 0), route=route)
+
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                breakdown = ", ".join(
+                    f"{phase}={seconds * 1000:.1f}ms ({phases.get(f'{phase}_count', 0)} calls)"
+                    for phase, seconds in phases.items() if not phase.endswith("_count")
+                )
+                logger.warning(f"Slow request {method} {route} -> {status_code} took {elapsed * 1000:.1f}ms [{breakdown or 'no tracked phases'}]")
@@ -1,24 +1,115 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index, DDL, event
 from sqlalchemy.orm import relationship
 from database import Base
 
+def canonical_email(email: str) -> str:
+    # normalized once on write so lookups stay a plain equality probe on ix_users_email_canonical
+    return email.strip().lower()
+
 class UserModel(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
+    email = Column(String, unique=True, index=True) # as the user typed it, used for display and for sending mail
+    email_canonical = Column(String, unique=True, index=True) # canonical_email(email), what every lookup filters on
     password = Column(String)
     is_verified = Column(Boolean, default=False)
     is_admin = Column(Boolean, default=False)
+    token_version = Column(Integer, default=0, server_default="0", nullable=False) # bumped to invalidate every issued access token
+    row_version = Column(Integer, default=0, server_default="0", nullable=False) # bumped on every profile write, the ETag of /get-user-data and friends
 
     verification_codes = relationship("VerificationCodeModel", back_populates="user")
 
+# prefix search and the admin email_prefix filter; text_pattern_ops lets Postgres use it for LIKE 'abc%' under any
+# collation. SQLite searches prefixes with a range that the unique index on email_canonical already serves
+Index("ix_users_email_canonical_pattern", UserModel.email_canonical, postgresql_ops={"email_canonical": "text_pattern_ops"}).ddl_if(dialect="postgresql")
+
+# substring and domain search, Postgres only (SQLite searches an in-memory snapshot instead, see search.py)
+Index(
+    "ix_users_email_canonical_trgm",
+    UserModel.email_canonical,
+    postgresql_using="gin",
+    postgresql_ops={"email_canonical": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+# everything a response may show about a user, selected without loading the ORM object or the hash
+USER_SUMMARY_COLUMNS = (UserModel.id, UserModel.email, UserModel.is_verified, UserModel.is_admin)
+
 class VerificationCodeModel(Base):
     __tablename__ = "verification_codes"
+    __table_args__ = (
+        Index("ix_verification_codes_user_id_code", "user_id", "code"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     code = Column(String)
+    expires_at = Column(DateTime, index=True)
+    created_at = Column(DateTime)
+    sent_at = Column(DateTime) # last time this code was emailed, drives the resend cooldown
+
+    user = relationship("UserModel", back_populates="verification_codes")
+
+class RefreshTokenModel(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    token_hash = Column(String(64), unique=True, index=True)
     expires_at = Column(DateTime)
+    revoked_at = Column(DateTime, nullable=True)
+
+class RevokedTokenModel(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String(32), unique=True)
+    expires_at = Column(DateTime, index=True)
+    revoked_at = Column(DateTime, index=True) # what each worker's denylist sync filters on
+
+class RevokedSessionModel(Base):
+    __tablename__ = "revoked_sessions"
+
+    # every access token of user_id with a lower token version is rejected, written by password changes and deletions
+    # so workers that trust the signed claims (JWT_TRUST_CLAIMS) see them without reading the users row
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False) # not a foreign key, rows outlive deleted users
+    token_version = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, index=True) # every token issued before the revocation has expired by then
+    revoked_at = Column(DateTime, index=True)
+
+class DomainStatsModel(Base):
+    __tablename__ = "email_domain_stats"
+
+    domain = Column(String, primary_key=True)
+    users = Column(Integer, nullable=False)
+    verified = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+class AuditEventModel(Base):
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        # newest-first keyset pagination walks this index backwards
+        Index("ix_audit_events_created_at_id", "created_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+    event = Column(String, nullable=False)
+    email = Column(String, index=True) # the account the event is about, not a foreign key so the trail outlives deleted users
+    actor = Column(String) # the admin behind admin actions
+    ip = Column(String)
+    detail = Column(String)
+
+class UserStatsModel(Base):
+    __tablename__ = "user_stats"
 
-    user = relationship("UserModel", back_populates="verification_codes")
\ No newline at end of file
+    # counters are split over a few rows so concurrent writers rarely wait on the same row lock, readers sum them
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    users = Column(Integer, nullable=False, default=0)
+    verified = Column(Integer, nullable=False, default=0)
+    admins = Column(Integer, nullable=False, default=0)
+    pending_codes = Column(Integer, nullable=False, default=0)
+    reconciled_at = Column(DateTime)
@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from sqlalchemy import event
+from dotenv import load_dotenv
+from database import engine, async_engine
+from metrics import request_phases
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", 5))
+PROFILING_MAX_STORED = int(os.getenv("PROFILING_MAX_STORED", 200)) # finished profiles kept per worker, oldest dropped first
+PROFILING_MAX_SQL = int(os.getenv("PROFILING_MAX_SQL", 200)) # statements recorded per profiled request
+
+# the profile of the request being served, read by the SQL listeners
+current_profile: ContextVar[dict | None] = ContextVar("current_profile", default=None)
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def thread_stack(frame) -> tuple:
+    # root first, the order collapsed-stack flamegraph tools expect
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+def await_stack(task) -> tuple:
+    # where a suspended request is waiting: follow the coroutine chain down to the awaited future
+    names = ["[awaiting]"]
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            names.append(f"[{type(awaitable).__name__}]")
+            break
+        names.append(frame_name(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return tuple(names)
+
+class Profiler:
+    def __init__(self, engines: list, sample_interval: float = PROFILING_SAMPLE_INTERVAL_MS / 1000, max_stored: int = PROFILING_MAX_STORED):
+        self.engines = engines
+        self.sample_interval = sample_interval
+        self.enabled = False
+        self.route = None
+        self.sample_rate = 1.0
+        self.expires_at = 0.0
+        self.remaining = 0
+        self.profiles = deque(maxlen=max_stored)
+        self.in_flight = {} # request task -> profile
+        self._next_id = 1
+        self._loop = None
+        self._loop_thread = None
+        self._sampler = None
+        self._wakeup = threading.Event()
+
+    def start(self, route: str | None, sample_rate: float, duration_seconds: float, max_profiles: int):
+        self.route = route
+        self.sample_rate = sample_rate
+        self.expires_at = time.monotonic() + duration_seconds
+        self.remaining = max_profiles
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+        if not self.enabled:
+            # listeners and the sampler thread only exist while profiling, so a disabled profiler costs nothing per query
+            for engine in self.engines:
+                event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+            self.enabled = True
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample, name="profiling-sampler", daemon=True)
+                self._sampler.start()
+            logger.warning(f"Profiling enabled for {route or 'all routes'} at {sample_rate:.0%} of requests, up to {max_profiles} requests")
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        self._wakeup.set()
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(engine, "after_cursor_execute", self._after_cursor_execute)
+        logger.warning(f"Profiling disabled, {len(self.profiles)} profiles stored")
+
+    def should_profile(self, path: str) -> bool:
+        if self.remaining <= 0 or time.monotonic() > self.expires_at:
+            self.stop()
+            return False
+        if self.route and not path.startswith(self.route):
+            return False
+        if random.random() >= self.sample_rate:
+            return False
+
+        self.remaining -= 1
+        return True
+
+    def begin(self, scope) -> dict:
+        profile = {
+            "id": self._next_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "started_at": datetime.utcnow(),
+            "status": None,
+            "duration_ms": None,
+            "phases": {},
+            "sql": [],
+            "samples": {},
+        }
+        self._next_id += 1
+        self.in_flight[asyncio.current_task()] = profile
+        self._wakeup.set()
+        return profile
+
+    def finish(self, profile: dict, status_code: int, elapsed: float, phases: dict | None):
+        self.in_flight.pop(asyncio.current_task(), None)
+        profile["status"] = status_code
+        profile["duration_ms"] = elapsed * 1000
+        profile["phases"] = {
+            phase: seconds * 1000 if not phase.endswith("_count") else seconds
+            for phase, seconds in (phases or {}).items()
+        }
+        self.profiles.append(profile)
+
+    def collapsed(self, profile_id: int | None = None) -> str:
+        # Brendan Gregg's collapsed format: "frame;frame;frame count", loads in flamegraph.pl, speedscope and inferno
+        totals = {}
+        for profile in list(self.profiles):
+            if profile_id is not None and profile["id"] != profile_id:
+                continue
+            root = f"{profile['method']} {profile['path']}"
+            for stack, count in list(profile["samples"].items()):
+                key = ";".join((root, *stack))
+                totals[key] = totals.get(key, 0) + count
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(totals.items()))
+
+    def _sample(self):
+        while self.enabled:
+            if not self.in_flight:
+                self._wakeup.wait(timeout=1)
+                self._wakeup.clear()
+                continue
+
+            try:
+                running = asyncio.current_task(self._loop)
+                frames = sys._current_frames()
+                for task, profile in list(self.in_flight.items()):
+                    # the running request is on-CPU in the loop thread, every other one is parked on an await
+                    if task is running and self._loop_thread in frames:
+                        stack = thread_stack(frames[self._loop_thread])
+                    else:
+                        stack = await_stack(task)
+                    profile["samples"][stack] = profile["samples"].get(stack, 0) + 1
+                del frames
+            except Exception as e:
+                # the coroutine chain can change under us while it is walked, the next sample will do
+                logger.debug(f"Dropped a profiling sample: {e}")
+
+            time.sleep(self.sample_interval)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # kept on the execution context like the metrics timer, a failed statement cannot leave a stale start behind
+        if current_profile.get() is not None:
+            context._profile_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        start = getattr(context, "_profile_query_start", None)
+        if profile is None or start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+        if len(profile["sql"]) < PROFILING_MAX_SQL:
+            profile["sql"].append({"statement": " ".join(statement.split())[:1000], "ms": elapsed * 1000, "executemany": executemany})
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    def __call__(self, scope, receive, send):
+        # not a coroutine: while profiling is off the inner app's awaitable is handed straight back,
+        # so a disabled profiler adds one attribute check and no extra frame to every request
+        if not self.profiler.enabled or scope["type"] != "http" or not self.profiler.should_profile(scope["path"]):
+            return self.app(scope, receive, send)
+        return self.profile_request(scope, receive, send)
+
+    async def profile_request(self, scope, receive, send):
+        profile = self.profiler.begin(scope)
+        token = current_profile.set(profile)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_profile.reset(token)
+            # MetricsMiddleware wraps this one, so the argon2/db/smtp phase totals of the request are already collected
+            self.profiler.finish(profile, status_code, time.perf_counter() - start, request_phases.get())
+
+profiler = Profiler([engine, async_engine.sync_engine])
@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from fastapi import Request, HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory") # "memory" or "redis"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+def parse_limit(value: str) -> tuple[int, float]:
+    # "<requests>/<seconds>", e.g. "10/60" allows bursts of 10 refilled over a minute
+    requests, seconds = value.split("/")
+    return int(requests), float(seconds)
+
+LOGIN_RATE_LIMIT_PER_IP = parse_limit(os.getenv("LOGIN_RATE_LIMIT_PER_IP", "30/60"))
+LOGIN_RATE_LIMIT_PER_EMAIL = parse_limit(os.getenv("LOGIN_RATE_LIMIT_PER_EMAIL", "10/300"))
+VERIFY_RATE_LIMIT_PER_IP = parse_limit(os.getenv("VERIFY_RATE_LIMIT_PER_IP", "30/60"))
+VERIFY_RATE_LIMIT_PER_EMAIL = parse_limit(os.getenv("VERIFY_RATE_LIMIT_PER_EMAIL", "10/300"))
+FORGOT_PASSWORD_RATE_LIMIT_PER_IP = parse_limit(os.getenv("FORGOT_PASSWORD_RATE_LIMIT_PER_IP", "10/60"))
+FORGOT_PASSWORD_RATE_LIMIT_PER_EMAIL = parse_limit(os.getenv("FORGOT_PASSWORD_RATE_LIMIT_PER_EMAIL", "3/300"))
+REGISTER_RATE_LIMIT_PER_IP = parse_limit(os.getenv("REGISTER_RATE_LIMIT_PER_IP", "10/60"))
+REGISTER_RATE_LIMIT_PER_EMAIL = parse_limit(os.getenv("REGISTER_RATE_LIMIT_PER_EMAIL", "3/300"))
+
+class MemoryBucketStore:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> (tokens, updated_at), least recently used first
+
+    async def consume(self, key: str, capacity: int, period: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * capacity / period)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) * period / capacity
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            # evicting the least recently used bucket only forgets a client that has been idle the longest
+            self._buckets.popitem(last=False)
+
+        return retry_after
+
+class RedisBucketStore:
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated_at) * capacity / period)
+    local retry_after = 0
+    if tokens >= 1 then
+      tokens = tokens - 1
+    else
+      retry_after = (1 - tokens) * period / capacity
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(period))
+    return tostring(retry_after)
+    """
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL):
+        import redis.asyncio as redis # optional dependency, only needed for shared limits across workers
+
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def consume(self, key: str, capacity: int, period: float) -> float:
+        return float(await self._script(keys=[f"ratelimit:{key}"], args=[capacity, period, time.time()]))
+
+def create_store():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisBucketStore()
+    return MemoryBucketStore()
+
+store = create_store()
+
+async def get_request_email(request: Request) -> str | None:
+    email = request.query_params.get("email")
+    if email is None and request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            # FastAPI has already read and cached the body, so this does not consume the stream
+            body = await request.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            email = body.get("email")
+
+    return email.strip().lower() if isinstance(email, str) else None
+
+class RateLimit:
+    def __init__(self, scope: str, per_ip: tuple[int, float], per_email: tuple[int, float]):
+        self.scope = scope
+        self.per_ip = per_ip
+        self.per_email = per_email
+
+    async def __call__(self, request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+
+        client_ip = request.client.host if request.client else "unknown"
+        keys = [(f"{self.scope}:ip:{client_ip}", self.per_ip)]
+
+        email = await get_request_email(request)
+        if email:
+            keys.append((f"{self.scope}:email:{email}", self.per_email))
+
+        for key, (capacity, period) in keys:
+            retry_after = await store.consume(key, capacity, period)
+            if retry_after > 0:
+                logger.warning(f"Rate limit exceeded for {key}")
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, please try again later",
+                    headers={"Retry-After": str(int(retry_after) + 1)}
+                )
+
+login_rate_limit = RateLimit("login", LOGIN_RATE_LIMIT_PER_IP, LOGIN_RATE_LIMIT_PER_EMAIL)
+verify_rate_limit = RateLimit("verify", VERIFY_RATE_LIMIT_PER_IP, VERIFY_RATE_LIMIT_PER_EMAIL)
+forgot_password_rate_limit = RateLimit("forgot-password", FORGOT_PASSWORD_RATE_LIMIT_PER_IP, FORGOT_PASSWORD_RATE_LIMIT_PER_EMAIL)
+register_rate_limit = RateLimit("register", REGISTER_RATE_LIMIT_PER_IP, REGISTER_RATE_LIMIT_PER_EMAIL)
@@ -0,0 +1,63 @@
+import os
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from models import UserModel, RefreshTokenModel
+
+load_dotenv()
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_refresh_token(session: AsyncSession, user_id: int) -> str:
+    # only the hash is stored, the caller commits
+    token = secrets.token_urlsafe(32)
+    session.add(RefreshTokenModel(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+async def revoke_refresh_tokens(session: AsyncSession, user_id: int):
+    await session.execute(
+        update(RefreshTokenModel)
+        .where(RefreshTokenModel.user_id == user_id, RefreshTokenModel.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+async def rotate_refresh_token(session: AsyncSession, token: str) -> tuple[UserModel, str] | None:
+    stored = await session.scalar(select(RefreshTokenModel).where(RefreshTokenModel.token_hash == hash_refresh_token(token)))
+    if stored is None or stored.expires_at <= datetime.utcnow():
+        return None
+
+    if stored.revoked_at is not None:
+        # a rotated token was replayed, assume it leaked and end every session of that user
+        await revoke_refresh_tokens(session, stored.user_id)
+        await session.commit()
+        return None
+
+    user = await session.get(UserModel, stored.user_id)
+    if user is None:
+        return None
+
+    # the conditional update makes sure only one of two concurrent refreshes wins the rotation
+    rotated = await session.execute(
+        update(RefreshTokenModel)
+        .where(RefreshTokenModel.id == stored.id, RefreshTokenModel.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if rotated.rowcount != 1:
+        await session.rollback()
+        return None
+
+    new_token = issue_refresh_token(session, user.id)
+    await session.commit()
+
+    return user, new_token
@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, insert, literal, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import RevokedTokenModel, RevokedSessionModel
+from tokens import token_service
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+DENYLIST_SYNC_INTERVAL_SECONDS = float(os.getenv("DENYLIST_SYNC_INTERVAL_SECONDS", 10))
+DENYLIST_SYNC_OVERLAP_SECONDS = float(os.getenv("DENYLIST_SYNC_OVERLAP_SECONDS", 60)) # re-read window for rows that commit late or under clock skew
+
+DELETED_USER_TOKEN_VERSION = 2**31 - 1 # above any version a live user reaches, rejects every token of a deleted user
+
+def utc_timestamp(value: datetime) -> float:
+    # the columns hold naive UTC, .timestamp() alone would read them as local time
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+class TokenDenylist:
+    def __init__(self):
+        self._expiries = {} # jti -> exp (unix seconds), entries are dropped once the token would have expired anyway
+        self._sessions = {} # user id -> (lowest accepted token version, unix seconds after which no older token is left)
+        self._synced_since = None # revoked_at lower bound of the next sync, None reads every unexpired row
+
+    def add(self, jti: str, expires_at: float):
+        self._expiries[jti] = expires_at
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._expiries
+
+    def add_session_revocation(self, user_id: int, token_version: int, expires_at: float):
+        version, expiry = self._sessions.get(user_id, (0, 0.0))
+        self._sessions[user_id] = (max(version, token_version), max(expiry, expires_at))
+
+    def is_revoked_session(self, user_id: int, token_version: int) -> bool:
+        revoked = self._sessions.get(user_id)
+        return revoked is not None and token_version < revoked[0]
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def clear(self):
+        self._expiries.clear()
+        self._sessions.clear()
+        self._synced_since = None
+
+    def evict_expired(self):
+        now = time.time()
+        self._expiries = {jti: expires_at for jti, expires_at in self._expiries.items() if expires_at > now}
+        self._sessions = {user_id: revoked for user_id, revoked in self._sessions.items() if revoked[1] > now}
+
+    async def sync(self, session: AsyncSession):
+        # ids can commit out of order, so rows are read by revocation time with an overlap;
+        # rows already known are simply added again
+        started = datetime.utcnow()
+        query = select(RevokedTokenModel.jti, RevokedTokenModel.expires_at)
+        sessions = select(RevokedSessionModel.user_id, RevokedSessionModel.token_version, RevokedSessionModel.expires_at)
+        if self._synced_since is None:
+            query = query.where(RevokedTokenModel.expires_at > started)
+            sessions = sessions.where(RevokedSessionModel.expires_at > started)
+        else:
+            query = query.where(RevokedTokenModel.revoked_at >= self._synced_since)
+            sessions = sessions.where(RevokedSessionModel.revoked_at >= self._synced_since)
+
+        for row in (await session.execute(query)).all():
+            self.add(row.jti, utc_timestamp(row.expires_at))
+        for row in (await session.execute(sessions)).all():
+            self.add_session_revocation(row.user_id, row.token_version, utc_timestamp(row.expires_at))
+        self._synced_since = started - timedelta(seconds=DENYLIST_SYNC_OVERLAP_SECONDS)
+
+denylist = TokenDenylist()
+
+async def revoke_access_token(session: AsyncSession, jti: str, exp: int):
+    expires_at = datetime.utcfromtimestamp(exp)
+    session.add(RevokedTokenModel(jti=jti, expires_at=expires_at, revoked_at=datetime.utcnow()))
+    await session.commit()
+    denylist.add(jti, float(exp))
+
+def on_commit(session: AsyncSession, callback):
+    # this worker applies a revocation once it is committed, a rolled back change must not log the user out
+    event.listen(session.sync_session, "after_commit", lambda _: callback(), once=True)
+
+def revoke_sessions(session: AsyncSession, user_id: int, token_version: int):
+    # part of the caller's transaction, so the row commits with the password change or deletion it records
+    now = datetime.utcnow()
+    expires_at = now + token_service.expires_in
+    session.add(RevokedSessionModel(user_id=user_id, token_version=token_version, expires_at=expires_at, revoked_at=now))
+    on_commit(session, lambda: denylist.add_session_revocation(user_id, token_version, utc_timestamp(expires_at)))
+
+async def revoke_deleted_users(session: AsyncSession, user_ids):
+    # user_ids is a select of ids, deleting every user writes its rows in one INSERT ... SELECT
+    now = datetime.utcnow()
+    expires_at = now + token_service.expires_in
+    ids = user_ids.subquery()
+    revoked = await session.execute(
+        insert(RevokedSessionModel)
+        .from_select(
+            ["user_id", "token_version", "expires_at", "revoked_at"],
+            select(ids.c[0], literal(DELETED_USER_TOKEN_VERSION), literal(expires_at), literal(now))
+        )
+        .returning(RevokedSessionModel.user_id)
+    )
+    user_ids = revoked.scalars().all()
+
+    def add_all():
+        for user_id in user_ids:
+            denylist.add_session_revocation(user_id, DELETED_USER_TOKEN_VERSION, utc_timestamp(expires_at))
+
+    on_commit(session, add_all)
+
+async def run_denylist_sync():
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                await denylist.sync(session)
+                await session.execute(delete(RevokedTokenModel).where(RevokedTokenModel.expires_at <= datetime.utcnow()))
+                await session.execute(delete(RevokedSessionModel).where(RevokedSessionModel.expires_at <= datetime.utcnow()))
+                await session.commit()
+            denylist.evict_expired()
+        except Exception as e:
+            logger.error(f"Unexpected error while syncing the token denylist: {e}", exc_info=True)
+
+        await asyncio.sleep(DENYLIST_SYNC_INTERVAL_SECONDS)
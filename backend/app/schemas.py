@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict
 
 class UserSchema(BaseModel):
     email: str
@@ -7,6 +8,10 @@ class UserSchema(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class UserUpdate(BaseModel):
     email: str | None = None
@@ -24,4 +29,103 @@ class UpdatePasswordRequest(BaseModel):
 
 class HTTPRequest(BaseModel):
     status: int
-    message: str
\ No newline at end of file
+    message: str
+
+class UserSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True) # built straight from column-only result rows
+
+    id: int
+    email: str
+    is_verified: bool
+    is_admin: bool
+
+class UserPage(BaseModel):
+    users: list[UserSummary]
+    next_cursor: int | None = None
+
+class UserSearchPage(BaseModel):
+    users: list[UserSummary]
+    total: int
+    next_cursor: int | None = None
+
+class DomainStats(BaseModel):
+    domain: str
+    users: int
+    verified: int
+    verified_ratio: float
+
+class DomainStatsPage(BaseModel):
+    domains: list[DomainStats]
+    refreshed_at: datetime | None = None
+
+class UserStats(BaseModel):
+    users: int
+    verified: int
+    unverified: int
+    admins: int
+    pending_codes: int
+    reconciled_at: datetime | None = None
+
+class ProfilingRequest(BaseModel):
+    route: str | None = None # path prefix, e.g. /api/auth/login, None profiles every route
+    sample_rate: float = 1.0
+    duration_seconds: float = 300
+    max_profiles: int = 50
+
+class ProfilingStatus(BaseModel):
+    enabled: bool
+    route: str | None = None
+    sample_rate: float
+    remaining: int
+    stored: int
+
+class SQLTiming(BaseModel):
+    statement: str
+    ms: float
+    executemany: bool = False
+
+class RequestProfile(BaseModel):
+    id: int
+    method: str
+    path: str
+    started_at: datetime
+    status: int | None = None
+    duration_ms: float | None = None
+    phases: dict[str, float]
+    sql: list[SQLTiming]
+    samples: int
+
+class AuditEvent(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    created_at: datetime
+    event: str
+    email: str | None = None
+    actor: str | None = None
+    ip: str | None = None
+    detail: str | None = None
+
+class AuditEventPage(BaseModel):
+    events: list[AuditEvent]
+    next_cursor: str | None = None
+
+class BulkRowResult(BaseModel):
+    row: int
+    email: str | None = None
+    status: str
+    detail: str | None = None
+
+class BulkResult(BaseModel):
+    processed: int
+    succeeded: int
+    failed: int
+    results: list[BulkRowResult]
+
+class Principal(BaseModel):
+    id: int
+    email: str
+    is_admin: bool
+    is_verified: bool
+    token_version: int = 0
+    row_version: int | None = None # None when built from token claims alone
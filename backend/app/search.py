@@ -0,0 +1,139 @@
+import os
+import time
+import bisect
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete, insert, func, case, literal, literal_column, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import UserModel, DomainStatsModel, USER_SUMMARY_COLUMNS
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+SEARCH_SNAPSHOT_TTL_SECONDS = float(os.getenv("SEARCH_SNAPSHOT_TTL_SECONDS", 30))
+DOMAIN_STATS_REFRESH_SECONDS = float(os.getenv("DOMAIN_STATS_REFRESH_SECONDS", 300))
+
+DOMAIN_STATS_LOCK_ID = 7300118 # pg advisory lock, so only one worker recomputes the aggregates per interval
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_condition(mode: str, term: str, dialect_name: str):
+    if mode == "prefix":
+        if dialect_name == "sqlite":
+            # SQLite's case-insensitive LIKE never uses an index, the equivalent range uses ix_users_email_canonical
+            return (UserModel.email_canonical >= term) & (UserModel.email_canonical < prefix_upper_bound(term))
+        return UserModel.email_canonical.like(escape_like(term) + "%", escape="\\")
+    if mode == "domain":
+        return UserModel.email_canonical.like("%@" + escape_like(term), escape="\\")
+    return UserModel.email_canonical.like("%" + escape_like(term) + "%", escape="\\")
+
+class EmailSnapshot:
+    # SQLite has no trigram index, so substring and domain search scan an in-memory copy of (id, email_canonical)
+    def __init__(self, ttl_seconds: float = SEARCH_SNAPSHOT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.loaded_at = None
+        self.emails = [] # (id, email) ordered by id
+        self.domains = {} # domain -> ids ordered by id
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_seconds
+
+    async def refresh(self, session: AsyncSession):
+        if self._fresh():
+            return
+
+        async with self._lock:
+            if self._fresh():
+                return
+
+            rows = (await session.execute(select(UserModel.id, UserModel.email_canonical).order_by(UserModel.id))).all()
+            domains = {}
+            for user_id, email in rows:
+                domains.setdefault(email.rpartition("@")[2], []).append(user_id)
+
+            self.emails = rows
+            self.domains = domains
+            self.loaded_at = time.monotonic()
+
+    def matching_ids(self, mode: str, term: str) -> list:
+        if mode == "domain":
+            return self.domains.get(term, [])
+        return [user_id for user_id, email in self.emails if term in email]
+
+snapshot = EmailSnapshot()
+
+async def search_users(session: AsyncSession, mode: str, term: str, cursor: int | None, limit: int) -> tuple[list, int, int | None]:
+    term = term.strip().lower()
+    dialect_name = session.bind.dialect.name
+
+    if dialect_name == "sqlite" and mode != "prefix":
+        await snapshot.refresh(session)
+        ids = snapshot.matching_ids(mode, term)
+        start = bisect.bisect_right(ids, cursor) if cursor is not None else 0
+        page = ids[start:start + limit]
+        rows = (await session.execute(select(*USER_SUMMARY_COLUMNS).where(UserModel.id.in_(page)).order_by(UserModel.id))).all() if page else []
+        next_cursor = page[-1] if start + limit < len(ids) else None
+        return rows, len(ids), next_cursor
+
+    condition = search_condition(mode, term, dialect_name)
+    total = await session.scalar(select(func.count()).select_from(UserModel).where(condition))
+
+    query = select(*USER_SUMMARY_COLUMNS).where(condition).order_by(UserModel.id)
+    if cursor is not None:
+        query = query.where(UserModel.id > cursor)
+    rows = (await session.execute(query.limit(limit + 1))).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], total, next_cursor
+
+def email_domain(dialect_name: str):
+    # inlined rather than bound, asyncpg numbers each occurrence separately and GROUP BY would no longer match the SELECT
+    if dialect_name == "postgresql":
+        return func.split_part(UserModel.email_canonical, literal_column("'@'"), literal_column("2"))
+    return func.substr(UserModel.email_canonical, func.instr(UserModel.email_canonical, "@") + 1)
+
+async def refresh_domain_stats() -> int | None:
+    async with AsyncSessionLocal() as session:
+        dialect_name = session.bind.dialect.name
+        if dialect_name == "postgresql":
+            # every worker runs the refresh loop, the transaction-scoped try-lock lets one of them do the work
+            if not await session.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": DOMAIN_STATS_LOCK_ID}):
+                return None
+
+        domain = email_domain(dialect_name)
+        aggregates = (
+            select(
+                domain,
+                func.count(),
+                func.sum(case((UserModel.is_verified == True, 1), else_=0)),
+                literal(datetime.utcnow()),
+            )
+            .group_by(domain)
+        )
+
+        await session.execute(delete(DomainStatsModel))
+        result = await session.execute(
+            insert(DomainStatsModel).from_select(["domain", "users", "verified", "refreshed_at"], aggregates)
+        )
+        await session.commit()
+        return result.rowcount
+
+async def run_domain_stats_refresh():
+    while True:
+        try:
+            start = time.perf_counter()
+            domains = await refresh_domain_stats()
+            if domains is not None:
+                logger.info(f"Refreshed stats for {domains} email domains in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Unexpected error while refreshing email domain stats: {e}", exc_info=True)
+
+        await asyncio.sleep(DOMAIN_STATS_REFRESH_SECONDS)
@@ -0,0 +1,50 @@
+import os
+import sys
+import logging
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1)) # worker processes per replica
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30))
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1") # proxies trusted for X-Forwarded-For, used by rate limiting
+BOOTSTRAP_ON_START = os.getenv("BOOTSTRAP_ON_START", "true").lower() == "true"
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    if "--reload" in sys.argv:
+        # development: single process, restarts on code changes
+        uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
+        return
+
+    if not os.getenv("ARGON2_TIME_COST"):
+        # calibrated once before the workers start, so they neither race each other for CPU while timing
+        # nor each land on a different cost; they read the exported value and skip calibration
+        from hashing import configure_hashing, parameters
+        configure_hashing()
+        os.environ["ARGON2_TIME_COST"] = str(parameters["time_cost"])
+
+    if BOOTSTRAP_ON_START:
+        # runs once per replica before workers fork, the advisory lock makes concurrent replicas take turns
+        from bootstrap import create_schema
+        create_schema()
+        logger.info("Schema is up to date")
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+    )
+
+if __name__ == "__main__":
+    main()
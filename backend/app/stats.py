@@ -0,0 +1,122 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, case, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal, dialect_insert
+from models import UserModel, VerificationCodeModel, UserStatsModel
+from schemas import UserStats
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", 8))
+STATS_CACHE_TTL_SECONDS = float(os.getenv("STATS_CACHE_TTL_SECONDS", 5))
+STATS_RECONCILE_SECONDS = float(os.getenv("STATS_RECONCILE_SECONDS", 3600))
+
+STATS_LOCK_ID = 7300122 # pg advisory lock, so only one worker recounts per interval
+
+COUNTERS = ("users", "verified", "admins", "pending_codes")
+
+stats_cache = TTLCache(max_size=1, ttl_seconds=STATS_CACHE_TTL_SECONDS)
+
+async def bump_stats(session: AsyncSession, **deltas):
+    # runs in the caller's transaction, so the counters commit or roll back together with the change they count
+    values = {name: getattr(UserStatsModel, name) + delta for name, delta in deltas.items() if delta}
+    if values:
+        await session.execute(
+            update(UserStatsModel)
+            .where(UserStatsModel.shard == random.randrange(STATS_SHARDS))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+async def read_stats(session: AsyncSession) -> UserStats:
+    stats = stats_cache.get("totals")
+    if stats is not None:
+        return stats
+
+    # a handful of shard rows whatever the size of the users table
+    row = (await session.execute(
+        select(*(func.coalesce(func.sum(getattr(UserStatsModel, name)), 0) for name in COUNTERS), func.max(UserStatsModel.reconciled_at))
+    )).one()
+    users, verified, admins, pending_codes, reconciled_at = row
+
+    stats = UserStats(
+        users=users,
+        verified=verified,
+        unverified=users - verified,
+        admins=admins,
+        pending_codes=pending_codes,
+        reconciled_at=reconciled_at
+    )
+    stats_cache.set("totals", stats)
+    return stats
+
+async def reconcile_stats(max_age: float | None = None) -> dict | None:
+    async with AsyncSessionLocal() as session:
+        # seeded on its own, so bump_stats has rows to update even when the recount below is skipped
+        await session.execute(
+            dialect_insert(UserStatsModel)
+            .values([{"shard": shard, **{name: 0 for name in COUNTERS}} for shard in range(STATS_SHARDS)])
+            .on_conflict_do_nothing()
+        )
+        await session.commit()
+
+        if session.bind.dialect.name == "postgresql":
+            if not await session.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": STATS_LOCK_ID}):
+                return None
+
+        if max_age is not None:
+            reconciled_at = await session.scalar(select(func.max(UserStatsModel.reconciled_at)))
+            if reconciled_at is not None and reconciled_at > datetime.utcnow() - timedelta(seconds=max_age):
+                return None
+
+        # the counters and the recount come from one statement and so one snapshot, without locking anything.
+        # writers that commit after it have bumped their shard and are not in the count, so only the
+        # difference is applied on top of whatever the shards hold by then
+        counted_columns = (
+            select(func.count()).select_from(UserModel).scalar_subquery(),
+            select(func.coalesce(func.sum(case((UserModel.is_verified == True, 1), else_=0)), 0)).scalar_subquery(),
+            select(func.coalesce(func.sum(case((UserModel.is_admin == True, 1), else_=0)), 0)).scalar_subquery(),
+            select(func.count()).select_from(VerificationCodeModel).scalar_subquery(),
+        )
+        previous_columns = (
+            select(func.coalesce(func.sum(getattr(UserStatsModel, name)), 0)).scalar_subquery() for name in COUNTERS
+        )
+        row = (await session.execute(select(*counted_columns, *previous_columns))).one()
+        counted = dict(zip(COUNTERS, row[:len(COUNTERS)]))
+        previous = dict(zip(COUNTERS, row[len(COUNTERS):]))
+        drift = {name: counted[name] - previous[name] for name in COUNTERS}
+
+        # a single shard row is locked, and only for this update
+        await session.execute(
+            update(UserStatsModel)
+            .where(UserStatsModel.shard == 0)
+            .values(**{name: getattr(UserStatsModel, name) + delta for name, delta in drift.items()}, reconciled_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+    stats_cache.clear()
+    return drift
+
+async def run_stats_reconciler():
+    while True:
+        try:
+            start = time.perf_counter()
+            # skipped when another worker recounted recently, which also spares a rolling restart from recounting
+            drift = await reconcile_stats(max_age=STATS_RECONCILE_SECONDS / 2)
+            if drift is not None:
+                corrected = {name: delta for name, delta in drift.items() if delta}
+                logger.info(f"Recounted user stats in {time.perf_counter() - start:.2f}s" + (f", corrected drift {corrected}" if corrected else ""))
+        except Exception as e:
+            logger.error(f"Unexpected error while recounting user stats: {e}", exc_info=True)
+
+        await asyncio.sleep(STATS_RECONCILE_SECONDS)
@@ -0,0 +1,110 @@
+import os
+import uuid
+import logging
+from pathlib import Path
+from datetime import datetime, timedelta
+import jwt
+from jwt.algorithms import RSAAlgorithm, ECAlgorithm, OKPAlgorithm
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+HASHING_ALGORITHM = os.getenv("HASHING_ALGORITHM", "HS256") # algorithm for JWT_SECRET_KEY, asymmetric keys infer theirs
+JWT_PREVIOUS_SECRET_KEYS = os.getenv("JWT_PREVIOUS_SECRET_KEYS", "") # "kid:secret,..." still accepted for verification
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR") # <kid>.pem private keys (signing) or <kid>.pub.pem public keys (verify only)
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+
+class SigningKey:
+    def __init__(self, kid: str, algorithm: str, private_key, public_key):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = public_key
+
+    def jwk(self) -> dict | None:
+        # symmetric secrets are never published
+        if self.algorithm.startswith("HS"):
+            return None
+
+        if self.algorithm.startswith("RS"):
+            jwk = RSAAlgorithm.to_jwk(self.public_key, as_dict=True)
+        elif self.algorithm.startswith("ES"):
+            jwk = ECAlgorithm.to_jwk(self.public_key, as_dict=True)
+        else:
+            jwk = OKPAlgorithm.to_jwk(self.public_key, as_dict=True)
+
+        return {**jwk, "kid": self.kid, "alg": self.algorithm, "use": "sig"}
+
+class TokenService:
+    def __init__(self, keys: list, active_kid: str, expire_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES):
+        self.keys = {key.kid: key for key in keys}
+        self.active = self.keys[active_kid]
+        self.expires_in = timedelta(minutes=expire_minutes)
+        self._jwks = {"keys": [jwk for jwk in (key.jwk() for key in keys) if jwk]}
+
+    def sign(self, claims: dict) -> str:
+        payload = {**claims, "exp": datetime.utcnow() + self.expires_in, "jti": uuid.uuid4().hex}
+        return jwt.encode(payload, self.active.private_key, algorithm=self.active.algorithm, headers={"kid": self.active.kid})
+
+    def verify(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            key = self.active
+        elif kid in self.keys:
+            key = self.keys[kid]
+        else:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid}")
+
+        # each key only accepts its own algorithm, so a token cannot pick a weaker one
+        return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
+    def jwks(self) -> dict:
+        return self._jwks
+
+def infer_algorithm(key) -> str:
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519, ed448
+
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return "RS256"
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return "ES256"
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey, ed448.Ed448PrivateKey, ed448.Ed448PublicKey)):
+        return "EdDSA"
+    raise ValueError(f"Unsupported key type {type(key).__name__}")
+
+def load_key_directory(path: str) -> list:
+    from cryptography.hazmat.primitives import serialization
+
+    keys = []
+    for file in sorted(Path(path).glob("*.pem")):
+        data = file.read_bytes()
+        if file.name.endswith(".pub.pem"):
+            public_key = serialization.load_pem_public_key(data)
+            keys.append(SigningKey(file.name[:-len(".pub.pem")], infer_algorithm(public_key), None, public_key))
+        else:
+            private_key = serialization.load_pem_private_key(data, password=None)
+            keys.append(SigningKey(file.stem, infer_algorithm(private_key), private_key, private_key.public_key()))
+    return keys
+
+def load_token_service() -> TokenService:
+    if JWT_KEYS_DIR:
+        keys = load_key_directory(JWT_KEYS_DIR)
+        signing = [key.kid for key in keys if key.private_key is not None]
+        if not signing:
+            raise RuntimeError(f"No private keys found in {JWT_KEYS_DIR}")
+        active_kid = JWT_ACTIVE_KID or signing[0]
+    else:
+        active_kid = JWT_ACTIVE_KID or "primary"
+        keys = [SigningKey(active_kid, HASHING_ALGORITHM, JWT_SECRET_KEY, JWT_SECRET_KEY)]
+        for entry in filter(None, JWT_PREVIOUS_SECRET_KEYS.split(",")):
+            kid, secret = entry.split(":", 1)
+            keys.append(SigningKey(kid, HASHING_ALGORITHM, None, secret))
+
+    logger.info(f"Loaded {len(keys)} JWT keys, signing with {active_kid}")
+    return TokenService(keys, active_kid)
+
+token_service = load_token_service()
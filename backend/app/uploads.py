@@ -0,0 +1,72 @@
+import csv
+import json
+from fastapi import Request, HTTPException, status
+
+async def iter_lines(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+async def iter_upload_rows(request: Request):
+    # yields (row_number, row) pairs from a CSV (with header) or NDJSON body without buffering the upload
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("text/csv", "application/x-ndjson", "application/jsonl"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload must be text/csv or application/x-ndjson"
+        )
+
+    header = None
+    row_number = 0
+    record = [] # physical lines of the CSV record being read, more than one when a quoted field holds a newline
+    quotes = 0
+    async for line in iter_lines(request):
+        if not record and not line.strip():
+            continue
+
+        if content_type == "text/csv":
+            # an odd number of quotes so far means a quoted field is still open on the next line
+            record.append(line + "\n")
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            values = next(csv.reader(record))
+            record, quotes = [], 0
+            if header is None:
+                header = [value.strip().lower() for value in values]
+                continue
+            row = dict(zip(header, values))
+        else:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+
+        row_number += 1
+        yield row_number, row if isinstance(row, dict) else None
+
+    if record and header is not None:
+        # a quote left open up to the end of the upload, csv takes the rest of the body as the field
+        yield row_number + 1, dict(zip(header, next(csv.reader(record))))
+
+def row_text(row: dict | None, field: str) -> str | None:
+    # NDJSON fields can be any JSON type, anything but a non-empty string counts as missing
+    value = (row or {}).get(field)
+    return value if isinstance(value, str) and value.strip() else None
+
+async def iter_upload_chunks(request: Request, chunk_size: int):
+    chunk = []
+    async for item in iter_upload_rows(request):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,155 @@
+import os
+import asyncio
+import logging
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import UserModel, VerificationCodeModel, canonical_email
+from fastapi import HTTPException, status
+from schemas import HTTPRequest
+from auth_utils import send_verification_email
+from stats import bump_stats
+
+load_dotenv()
+
+logger = logging.getLogger("uvicorn")
+
+VERIFICATION_CODE_TTL_MINUTES = int(os.getenv("VERIFICATION_CODE_TTL_MINUTES", 15))
+CODE_SWEEP_INTERVAL_SECONDS = float(os.getenv("CODE_SWEEP_INTERVAL_SECONDS", 300))
+CODE_SWEEP_BATCH_SIZE = int(os.getenv("CODE_SWEEP_BATCH_SIZE", 5000))
+VERIFICATION_CODE_REUSE_SECONDS = float(os.getenv("VERIFICATION_CODE_REUSE_SECONDS", 300)) # resend the outstanding code instead of minting a new one
+VERIFICATION_RESEND_COOLDOWN_SECONDS = float(os.getenv("VERIFICATION_RESEND_COOLDOWN_SECONDS", 60))
+VERIFICATION_MAX_ACTIVE_CODES = int(os.getenv("VERIFICATION_MAX_ACTIVE_CODES", 3))
+
+# user id -> issuance in flight in this worker, concurrent resend requests share its result
+pending_issues = {}
+
+def new_verification_code(user_id: int) -> VerificationCodeModel:
+    now = datetime.utcnow()
+    return VerificationCodeModel(
+        user_id=user_id,
+        code=secrets.token_hex(3),
+        expires_at=now + timedelta(minutes=VERIFICATION_CODE_TTL_MINUTES),
+        created_at=now,
+        sent_at=now
+    )
+
+def resend_cooldown_error(sent_at: datetime, now: datetime) -> HTTPException:
+    wait = max(1, int(VERIFICATION_RESEND_COOLDOWN_SECONDS - (now - sent_at).total_seconds()))
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"A verification code was sent recently, try again in {wait} seconds",
+        headers={"Retry-After": str(wait)}
+    )
+
+async def issue_verification_code(user_id: int, email: str) -> HTTPRequest:
+    task = pending_issues.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(send_or_reuse_code(user_id, email))
+        pending_issues[user_id] = task
+        task.add_done_callback(lambda _: pending_issues.pop(user_id, None))
+
+    # shielded so one caller disconnecting does not cancel the send the others are waiting on
+    return await asyncio.shield(task)
+
+async def send_or_reuse_code(user_id: int, email: str) -> HTTPRequest:
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        latest = (await session.execute(
+            select(VerificationCodeModel.id, VerificationCodeModel.created_at, VerificationCodeModel.sent_at)
+            .where(VerificationCodeModel.user_id == user_id, VerificationCodeModel.expires_at > now)
+            .order_by(VerificationCodeModel.id.desc())
+            .limit(1)
+        )).first()
+
+        cooldown_start = now - timedelta(seconds=VERIFICATION_RESEND_COOLDOWN_SECONDS)
+        if latest is not None and latest.sent_at is not None and latest.sent_at > cooldown_start:
+            raise resend_cooldown_error(latest.sent_at, now)
+
+        if latest is not None and latest.created_at is not None and latest.created_at > now - timedelta(seconds=VERIFICATION_CODE_REUSE_SECONDS):
+            # the guarded UPDATE claims the resend, so workers racing on the same user send it once
+            code = await session.scalar(
+                update(VerificationCodeModel)
+                .where(
+                    VerificationCodeModel.id == latest.id,
+                    or_(VerificationCodeModel.sent_at.is_(None), VerificationCodeModel.sent_at <= cooldown_start)
+                )
+                .values(sent_at=now)
+                .returning(VerificationCodeModel.code)
+                .execution_options(synchronize_session=False)
+            )
+            if code is None:
+                raise resend_cooldown_error(now, now)
+
+            # queued before the commit: if the mail queue is full the claim is rolled back and no cooldown starts
+            response = send_verification_email(email, code)
+            await session.commit()
+            return response
+
+        new_code = new_verification_code(user_id)
+        session.add(new_code)
+        await session.flush()
+
+        # only the newest codes stay valid, older ones are dropped instead of piling up per user
+        stale = (
+            select(VerificationCodeModel.id)
+            .where(VerificationCodeModel.user_id == user_id)
+            .order_by(VerificationCodeModel.id.desc())
+            .offset(VERIFICATION_MAX_ACTIVE_CODES)
+        )
+        dropped = await session.execute(
+            delete(VerificationCodeModel)
+            .where(VerificationCodeModel.id.in_(stale))
+            .execution_options(synchronize_session=False)
+        )
+        await bump_stats(session, pending_codes=1 - dropped.rowcount)
+
+        response = send_verification_email(email, new_code.code)
+        await session.commit()
+        return response
+
+async def consume_verification_code(session: AsyncSession, email: str, code: str) -> int | None:
+    # validates and invalidates the code in one DELETE ... RETURNING round-trip
+    user_id = select(UserModel.id).where(UserModel.email_canonical == canonical_email(email)).scalar_subquery()
+    result = await session.execute(
+        delete(VerificationCodeModel)
+        .where(
+            VerificationCodeModel.user_id == user_id,
+            VerificationCodeModel.code == code,
+            VerificationCodeModel.expires_at > datetime.utcnow()
+        )
+        .returning(VerificationCodeModel.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().first()
+
+async def sweep_expired_codes(batch_size: int = CODE_SWEEP_BATCH_SIZE) -> int:
+    deleted = 0
+    async with AsyncSessionLocal() as session:
+        while True:
+            expired = select(VerificationCodeModel.id).where(VerificationCodeModel.expires_at <= datetime.utcnow()).limit(batch_size)
+            result = await session.execute(
+                delete(VerificationCodeModel)
+                .where(VerificationCodeModel.id.in_(expired))
+                .execution_options(synchronize_session=False)
+            )
+            await bump_stats(session, pending_codes=-result.rowcount)
+            await session.commit()
+
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
+
+async def run_code_sweeper():
+    while True:
+        try:
+            deleted = await sweep_expired_codes()
+            if deleted:
+                logger.info(f"Deleted {deleted} expired verification codes")
+        except Exception as e:
+            logger.error(f"Unexpected error while sweeping verification codes: {e}", exc_info=True)
+
+        await asyncio.sleep(CODE_SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+# usage, from backend/:
+#   python benchmarks/idempotency_check.py --duplicates 20
+# exits non-zero when a duplicate submission is executed twice or answered differently
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, CodeSink, configure_environment, percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Submit the same mutating request concurrently with one Idempotency-Key and check it runs once")
+    parser.add_argument("--duplicates", type=int, default=20, help="concurrent copies of each request")
+    parser.add_argument("--retries", type=int, default=50, help="sequential retries after the first response, timed as cache hits")
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL, defaults to a throwaway SQLite file")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/idempotency-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+async def count_users(email: str) -> int:
+    from sqlalchemy import select, func
+    from database import AsyncSessionLocal
+    from models import UserModel, canonical_email
+
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count()).select_from(UserModel).where(UserModel.email_canonical == canonical_email(email)))
+
+async def timed(client, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return response, time.perf_counter() - start
+
+async def run(args, database_url: str) -> dict:
+    import httpx
+    import bootstrap
+    import mailer
+
+    sink = CodeSink()
+    mailer.dispatcher.transport = sink
+    bootstrap.reset_schema()
+
+    import main
+
+    checks = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            email = f"idem-{uuid.uuid4().hex[:8]}@example.com"
+            payload = {"email": email, "password": "pw-" + uuid.uuid4().hex}
+            headers = {"Idempotency-Key": uuid.uuid4().hex}
+
+            burst = await asyncio.gather(*(timed(client, "POST", "/api/auth/register", json=payload, headers=headers) for _ in range(args.duplicates)))
+            await mailer.dispatcher.queue.join()
+
+            responses = [response for response, _ in burst]
+            checks["one_user_created"] = await count_users(email) == 1
+            checks["one_email_sent"] = sink.sent == 1
+            checks["same_answer_for_every_duplicate"] = len({(response.status_code, response.content) for response in responses}) == 1
+            checks["first_answer_is_success"] = responses[0].status_code == 200
+            replayed = sum(1 for response in responses if response.headers.get("idempotent-replayed") == "true")
+            checks["all_but_one_replayed"] = replayed == args.duplicates - 1
+
+            retries = [await timed(client, "POST", "/api/auth/register", json=payload, headers=headers) for _ in range(args.retries)]
+            checks["retries_replay_the_success"] = all(response.status_code == 200 and response.headers.get("idempotent-replayed") == "true" for response, _ in retries)
+
+            changed = await client.post("/api/auth/register", json={**payload, "password": "other"}, headers=headers)
+            checks["reused_key_with_other_body_rejected"] = changed.status_code == 422
+
+            without_key = await client.post("/api/auth/register", json=payload)
+            checks["retry_without_key_still_conflicts"] = without_key.status_code == 400
+
+    original = sorted(seconds for _, seconds in burst)
+    cached = sorted(seconds for _, seconds in retries)
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"duplicates": args.duplicates, "retries": args.retries, "database": database_url.split("://", 1)[0]},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "checks": checks,
+        "burst_max_ms": original[-1] * 1000,
+        "retry_p50_ms": percentile(cached, 0.50) * 1000,
+        "retry_p95_ms": percentile(cached, 0.95) * 1000,
+    }
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    results = asyncio.run(run(args, database_url))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"idempotency-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    for name, passed in results["checks"].items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    print(f"{args.duplicates} concurrent duplicates answered within {results['burst_max_ms']:.1f}ms, "
+          f"cached retries p50 {results['retry_p50_ms']:.2f}ms p95 {results['retry_p95_ms']:.2f}ms")
+    print(f"Results written to {output}")
+    sys.exit(0 if all(results["checks"].values()) else 1)
+
+if __name__ == "__main__":
+    main()
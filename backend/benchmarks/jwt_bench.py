@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from datetime import datetime, timedelta
+
+# usage, from backend/:
+#   python benchmarks/jwt_bench.py --tokens 20000
+#   python benchmarks/jwt_bench.py --algorithms HS256 EdDSA --tokens 100000
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, APP_DIR, percentile
+
+ALGORITHMS = ("HS256", "RS256", "ES256", "EdDSA")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure access token sign and verify throughput per JWT algorithm")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS))
+    parser.add_argument("--tokens", type=int, default=20000, help="tokens signed and verified per algorithm")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/jwt-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+def signing_key(algorithm: str):
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+    from tokens import SigningKey
+
+    if algorithm == "HS256":
+        secret = os.urandom(32).hex()
+        return SigningKey("bench", algorithm, secret, secret)
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "ES256":
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    return SigningKey("bench", algorithm, private_key, private_key.public_key())
+
+def time_calls(function, arguments: list) -> tuple[dict, list]:
+    timings = []
+    results = []
+    start = time.perf_counter()
+    for argument in arguments:
+        call_start = time.perf_counter()
+        results.append(function(argument))
+        timings.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        "per_second": len(timings) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(timings, 0.50) * 1e6,
+        "p99_us": percentile(timings, 0.99) * 1e6,
+    }, results
+
+def claims_for(count: int) -> list:
+    return [{"sub": f"user{index}@example.com", "uid": index, "tv": 0, "admin": False, "verified": True} for index in range(count)]
+
+def run(args) -> dict:
+    import jwt
+    from tokens import TokenService
+
+    results = {}
+    claims = claims_for(args.tokens)
+    for algorithm in args.algorithms:
+        service = TokenService([signing_key(algorithm)], "bench")
+        sign, tokens = time_calls(service.sign, claims)
+        verify, _ = time_calls(service.verify, tokens)
+        results[algorithm] = {"sign": sign, "verify": verify, "token_bytes": len(tokens[0])}
+
+    # how tokens were made before the token service: the raw secret and algorithm handed to PyJWT per call
+    secret = os.urandom(32).hex()
+    expire_minutes = "15"
+
+    def legacy_sign(claims: dict) -> str:
+        return jwt.encode({**claims, "exp": datetime.utcnow() + timedelta(minutes=int(expire_minutes))}, secret, algorithm="HS256")
+
+    sign, tokens = time_calls(legacy_sign, claims)
+    verify, _ = time_calls(lambda token: jwt.decode(token, secret, algorithms=["HS256"]), tokens)
+    results["HS256 (direct PyJWT)"] = {"sign": sign, "verify": verify, "token_bytes": len(tokens[0])}
+
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"algorithms": args.algorithms, "tokens": args.tokens, "pyjwt": jwt.__version__},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "algorithms": results,
+    }
+
+def main():
+    args = parse_args()
+    # tokens builds the app's own service at import time, which needs a secret even though it is not used here
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-not-for-production")
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    results = run(args)
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"jwt-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"{'algorithm':<22}{'sign/s':>10}{'sign p50 us':>13}{'verify/s':>10}{'verify p50 us':>15}{'token bytes':>13}")
+    for algorithm, stats in results["algorithms"].items():
+        print(f"{algorithm:<22}{stats['sign']['per_second']:>10.0f}{stats['sign']['p50_us']:>13.1f}"
+              f"{stats['verify']['per_second']:>10.0f}{stats['verify']['p50_us']:>15.1f}{stats['token_bytes']:>13}")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
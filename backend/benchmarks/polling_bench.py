@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+# usage, from backend/:
+#   python benchmarks/polling_bench.py --users 50 --polls 200
+# polls the profile endpoints like the SPA does, once plain and once revalidating with If-None-Match
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, configure_environment, percentile, bearer, create_verified_users, queries_per_route
+
+ENDPOINTS = {
+    "users_me": lambda email: "/api/auth/users/me",
+    "get_user_data": lambda email: "/api/auth/get-user-data",
+    "admin_fetch_user_data": lambda email: f"/api/admin/fetch-user-data/{email}",
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Poll the profile endpoints with and without If-None-Match and compare latency and DB work")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--polls", type=int, default=200, help="polls per user per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL, defaults to a throwaway SQLite file")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/polling-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+async def poll(client, url: str, headers: dict, polls: int, conditional: bool, timings: list, statuses: dict):
+    etag = None
+    for _ in range(polls):
+        request_headers = {**headers, "If-None-Match": etag} if conditional and etag else headers
+        start = time.perf_counter()
+        response = await client.get(url, headers=request_headers)
+        timings.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        etag = response.headers.get("etag", etag)
+
+async def run(args, database_url: str) -> dict:
+    import httpx
+    import bootstrap
+    from sqlalchemy import update
+    from database import AsyncSessionLocal
+    from models import UserModel
+    from metrics import db_queries_per_request
+
+    bootstrap.reset_schema()
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    checks = {}
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            users = await create_verified_users(args.users + 1)
+            admin_email, admin_password = users.pop()
+            async with AsyncSessionLocal() as session:
+                await session.execute(update(UserModel).where(UserModel.email_canonical == admin_email).values(is_admin=True))
+                await session.commit()
+
+            tokens = [bearer(await client.post("/api/auth/login", json={"email": email, "password": password})) for email, password in users]
+            admin = bearer(await client.post("/api/auth/login", json={"email": admin_email, "password": admin_password}))
+            slots = asyncio.Semaphore(args.concurrency)
+
+            for endpoint, url in ENDPOINTS.items():
+                for mode in ("plain", "conditional"):
+                    timings, statuses = [], {}
+
+                    async def virtual_user(index: int):
+                        email = users[index][0]
+                        async with slots:
+                            await poll(client, url(email), admin if endpoint.startswith("admin") else tokens[index], args.polls, mode == "conditional", timings, statuses)
+
+                    queries_before = {key: list(series) for key, series in db_queries_per_request._series.items()}
+                    start = time.perf_counter()
+                    await asyncio.gather(*(virtual_user(index) for index in range(len(users))))
+                    elapsed = time.perf_counter() - start
+
+                    timings.sort()
+                    queries = queries_per_route(queries_before)
+                    results[f"{endpoint}/{mode}"] = {
+                        "requests": len(timings),
+                        "throughput_rps": len(timings) / elapsed if elapsed else 0.0,
+                        "p50_ms": percentile(timings, 0.50) * 1000,
+                        "p95_ms": percentile(timings, 0.95) * 1000,
+                        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                        "mean_queries": sum(route["mean_queries"] * route["requests"] for route in queries.values()) / max(1, sum(route["requests"] for route in queries.values())),
+                    }
+
+            # a write must change the validator, otherwise a poller would keep its stale copy
+            email, _ = users[0]
+            before = await client.get("/api/auth/get-user-data", headers=tokens[0])
+            admin_before = await client.get(f"/api/admin/fetch-user-data/{email}", headers=admin)
+            await client.put("/api/auth/update-user", json={"password": "changed-password"}, headers=tokens[0])
+            # a password change ends the session, the poller logs in again and revalidates its old copy
+            tokens[0] = bearer(await client.post("/api/auth/login", json={"email": email, "password": "changed-password"}))
+            after = await client.get("/api/auth/get-user-data", headers={**tokens[0], "If-None-Match": before.headers["etag"]})
+            admin_after = await client.get(f"/api/admin/fetch-user-data/{email}", headers={**admin, "If-None-Match": admin_before.headers["etag"]})
+            checks["write_changes_etag"] = after.status_code == 200 and after.headers.get("etag") != before.headers["etag"]
+            checks["admin_sees_write"] = admin_after.status_code == 200 and admin_after.headers.get("etag") != admin_before.headers["etag"]
+            unchanged = await client.get("/api/auth/get-user-data", headers={**tokens[0], "If-None-Match": after.headers["etag"]})
+            checks["unchanged_poll_is_304"] = unchanged.status_code == 304 and unchanged.content == b""
+
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"users": args.users, "polls": args.polls, "concurrency": args.concurrency, "database": database_url.split("://", 1)[0]},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "checks": checks,
+        "polls": results,
+    }
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    # the last seeded user becomes the admin, the admin routes also check ADMIN_EMAIL
+    os.environ["ADMIN_EMAIL"] = f"storm-{args.users}@example.com"
+    results = asyncio.run(run(args, database_url))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"polling-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"{'endpoint/mode':<36}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}  statuses")
+    for name, stats in results["polls"].items():
+        print(f"{name:<36}{stats['requests']:>9}{stats['throughput_rps']:>9.0f}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['mean_queries']:>9.2f}  {stats['statuses']}")
+    for name, passed in results["checks"].items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    print(f"Results written to {output}")
+    sys.exit(0 if all(results["checks"].values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+# usage, from backend/:
+#   python benchmarks/profiling_overhead.py --calls 200000 --requests 2000
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, configure_environment, percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure what ProfilingMiddleware costs per request when disabled and when sampling")
+    parser.add_argument("--calls", type=int, default=200000, help="direct ASGI calls per variant in the micro benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="GET /healthz requests per variant through the full app")
+    parser.add_argument("--rounds", type=int, default=5, help="alternating rounds, the fastest round of each variant is reported")
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL, defaults to a throwaway SQLite file")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/profiling-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+async def endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+class Passthrough:
+    # the floor for any ASGI middleware: an instance call that hands back the inner awaitable
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, scope, receive, send):
+        return self.app(scope, receive, send)
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+async def discard(message):
+    pass
+
+async def time_calls(app, calls: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/bench"}
+    start = time.perf_counter()
+    for _ in range(calls):
+        await app(scope, receive, discard)
+    return (time.perf_counter() - start) / calls
+
+async def time_requests(client, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await client.get("/healthz")
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+async def run(args, database_url: str) -> dict:
+    import httpx
+    import bootstrap
+    from profiling import Profiler, ProfilingMiddleware, profiler
+
+    # direct ASGI calls isolate the middleware from routing and HTTP parsing
+    disabled = Profiler(engines=[])
+    micro = {"bare": [], "passthrough": [], "disabled": []}
+    for _ in range(args.rounds):
+        micro["bare"].append(await time_calls(endpoint, args.calls))
+        micro["passthrough"].append(await time_calls(Passthrough(endpoint), args.calls))
+        micro["disabled"].append(await time_calls(ProfilingMiddleware(endpoint, profiler=disabled), args.calls))
+
+    bootstrap.reset_schema()
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    full = {"disabled": [], "enabled": []}
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(args.rounds):
+                full["disabled"].append(await time_requests(client, args.requests))
+                profiler.start("/healthz", 1.0, 3600, args.requests)
+                full["enabled"].append(await time_requests(client, args.requests))
+                profiler.stop()
+                profiler.profiles.clear()
+
+    best_micro = {name: min(rounds) * 1e9 for name, rounds in micro.items()}
+    best_full = {
+        name: min(({"p50_us": percentile(timings, 0.50) * 1e6, "p95_us": percentile(timings, 0.95) * 1e6} for timings in rounds), key=lambda stats: stats["p50_us"])
+        for name, rounds in full.items()
+    }
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"calls": args.calls, "requests": args.requests, "rounds": args.rounds},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "middleware_ns_per_call": best_micro,
+        "disabled_overhead_ns": best_micro["disabled"] - best_micro["bare"],
+        "healthz": best_full,
+    }
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    results = asyncio.run(run(args, database_url))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"profiling-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    micro = results["middleware_ns_per_call"]
+    print(f"direct ASGI call: bare {micro['bare']:.0f}ns, empty pass-through middleware {micro['passthrough']:.0f}ns, "
+          f"disabled ProfilingMiddleware {micro['disabled']:.0f}ns (+{results['disabled_overhead_ns']:.0f}ns)")
+    for name, stats in results["healthz"].items():
+        print(f"GET /healthz profiling {name:<9} p50 {stats['p50_us']:.0f}us  p95 {stats['p95_us']:.0f}us")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
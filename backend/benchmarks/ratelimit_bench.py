@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+# usage, from backend/:
+#   python benchmarks/ratelimit_bench.py --keys 1000 10000 100000 1000000
+#   python benchmarks/ratelimit_bench.py --keys 10000 100000 --redis-url redis://localhost:6379/0
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, APP_DIR, percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the rate limiter's cost per request as the number of tracked keys grows")
+    parser.add_argument("--keys", type=int, nargs="+", default=[1000, 10000, 100000, 1000000], help="distinct clients hitting the limiter")
+    parser.add_argument("--calls", type=int, default=200000, help="timed calls per key count and variant")
+    parser.add_argument("--redis-url", help="also time the shared Redis store, e.g. redis://localhost:6379/0")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/ratelimit-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+def request_for(ip: str, email: str):
+    from starlette.requests import Request
+
+    body = json.dumps({"email": email, "password": "password"}).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/auth/login",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": (ip, 12345),
+    }, receive)
+
+def summarize(timings: list, calls: int, elapsed: float, limited: int) -> dict:
+    timings.sort()
+    return {
+        "calls": calls,
+        "limited": limited,
+        "mean_us": elapsed / calls * 1e6,
+        "p50_us": percentile(timings, 0.50) * 1e6,
+        "p99_us": percentile(timings, 0.99) * 1e6,
+        "calls_per_second": calls / elapsed if elapsed else 0.0,
+    }
+
+async def time_store(store, keys: list, calls: int) -> dict:
+    # warm every key first, so the timed calls run against a store already holding all of them
+    for key in keys:
+        await store.consume(key, 10, 300)
+
+    rng = random.Random(1)
+    order = [keys[rng.randrange(len(keys))] for _ in range(calls)]
+    timings = []
+    limited = 0
+    start = time.perf_counter()
+    for key in order:
+        call_start = time.perf_counter()
+        limited += await store.consume(key, 10, 300) > 0
+        timings.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return summarize(timings, calls, elapsed, limited)
+
+async def time_dependency(limit, clients: list, calls: int) -> dict:
+    from fastapi import HTTPException
+
+    rng = random.Random(2)
+    requests = []
+    for _ in range(calls):
+        ip, email = clients[rng.randrange(len(clients))]
+        request = request_for(ip, email)
+        await request.body() # FastAPI has read the body before the dependency runs
+        requests.append(request)
+
+    timings = []
+    limited = 0
+    start = time.perf_counter()
+    for request in requests:
+        call_start = time.perf_counter()
+        try:
+            await limit(request)
+        except HTTPException:
+            limited += 1
+        timings.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return summarize(timings, calls, elapsed, limited)
+
+async def run(args) -> dict:
+    import rate_limit
+    from rate_limit import MemoryBucketStore, RedisBucketStore, RateLimit
+
+    results = {}
+    for count in args.keys:
+        keys = [f"login:email:user{index}@example.com" for index in range(count)]
+        variants = {
+            "memory": await time_store(MemoryBucketStore(max_keys=max(count, rate_limit.RATE_LIMIT_MAX_KEYS)), keys, args.calls),
+            # twice as many clients as slots, so most calls evict the least recently used bucket
+            "memory_evicting": await time_store(MemoryBucketStore(max_keys=max(1, count // 2)), keys, args.calls),
+        }
+        if args.redis_url:
+            variants["redis"] = await time_store(RedisBucketStore(args.redis_url), keys, min(args.calls, 20000))
+
+        # the whole dependency: client IP, email from the cached JSON body, then the IP and email buckets
+        rate_limit.store = MemoryBucketStore(max_keys=max(2 * count, rate_limit.RATE_LIMIT_MAX_KEYS))
+        clients = [(f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}", f"user{index}@example.com") for index in range(count)]
+        variants["login_dependency"] = await time_dependency(RateLimit("login", (1000000, 60), (1000000, 300)), clients, min(args.calls, 100000))
+
+        results[str(count)] = variants
+
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"keys": args.keys, "calls": args.calls, "redis": bool(args.redis_url)},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "keys": results,
+    }
+
+def main():
+    args = parse_args()
+    # the limiter needs no database, and its dependency returns straight away when limiting is off
+    os.environ["RATE_LIMIT_ENABLED"] = "true"
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    results = asyncio.run(run(args))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"ratelimit-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"{'keys':<10}{'variant':<18}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'calls/s':>12}")
+    for count, variants in results["keys"].items():
+        for name, stats in variants.items():
+            print(f"{count:<10}{name:<18}{stats['mean_us']:>10.2f}{stats['p50_us']:>10.2f}{stats['p99_us']:>10.2f}{stats['calls_per_second']:>12.0f}")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+# usage, from backend/:
+#   python benchmarks/serialization_bench.py --sizes 100 1000 10000
+#   python benchmarks/serialization_bench.py --sizes 1000 --repeat 100
+# "before" is how user lists were served before the summary schemas: ORM objects, hashes included,
+# through jsonable_encoder and the stdlib JSONResponse. "after" is the column-only select, UserSummary
+# validated from the rows, model_dump and ORJSONResponse, as fetch-users-data does now
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import BENCH_DIR, configure_environment, percentile
+from search_bench import seed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time fetching and serializing large user lists, ORM and jsonable_encoder against summary rows and orjson")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="users per list")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per step and size")
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL, defaults to a throwaway SQLite file")
+    parser.add_argument("--output", help="JSON results file, defaults to benchmarks/results/serialization-<timestamp>.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+async def time_step(step, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = step()
+        if asyncio.iscoroutine(result):
+            await result
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {"p50_ms": percentile(timings, 0.50) * 1000, "p95_ms": percentile(timings, 0.95) * 1000}
+
+async def time_size(size: int, repeat: int) -> dict:
+    from sqlalchemy import select
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from database import AsyncSessionLocal
+    from models import UserModel, USER_SUMMARY_COLUMNS
+    from schemas import UserSummary, UserPage
+
+    async with AsyncSessionLocal() as session:
+        async def fetch_orm():
+            session.expunge_all()
+            return (await session.scalars(select(UserModel).order_by(UserModel.id).limit(size))).all()
+
+        async def fetch_rows():
+            return (await session.execute(select(*USER_SUMMARY_COLUMNS).order_by(UserModel.id).limit(size))).all()
+
+        orm_users = await fetch_orm()
+        rows = await fetch_rows()
+        page = UserPage(users=[UserSummary.model_validate(row) for row in rows])
+        dumped = page.model_dump(mode="json")
+        encoded = jsonable_encoder(page)
+
+        steps = {
+            "fetch_orm": await time_step(fetch_orm, repeat),
+            "fetch_rows": await time_step(fetch_rows, repeat),
+            "validate_orm": await time_step(lambda: [UserSummary.model_validate(user) for user in orm_users], repeat),
+            "validate_rows": await time_step(lambda: [UserSummary.model_validate(row) for row in rows], repeat),
+            "jsonable_encoder": await time_step(lambda: jsonable_encoder(page), repeat),
+            "model_dump": await time_step(lambda: page.model_dump(mode="json"), repeat),
+            "json_response": await time_step(lambda: JSONResponse(encoded), repeat),
+            "orjson_response": await time_step(lambda: ORJSONResponse(dumped), repeat),
+        }
+
+        async def before():
+            users = await fetch_orm()
+            return JSONResponse(jsonable_encoder(UserPage(users=[UserSummary.model_validate(user) for user in users])))
+
+        async def after():
+            page = UserPage(users=[UserSummary.model_validate(row) for row in await fetch_rows()])
+            return ORJSONResponse(page.model_dump(mode="json"))
+
+        pipelines = {"before": await time_step(before, repeat), "after": await time_step(after, repeat)}
+
+    for stats in pipelines.values():
+        stats["users_per_second"] = size / (stats["p50_ms"] / 1000) if stats["p50_ms"] else 0.0
+    return {"steps": steps, "pipelines": pipelines, "body_bytes": len(ORJSONResponse(dumped).body)}
+
+async def run(args, database_url: str) -> dict:
+    import bootstrap
+
+    bootstrap.reset_schema()
+    seed_seconds = await seed(max(args.sizes), 1000, 20000)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = await time_size(size, args.repeat)
+
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {"sizes": args.sizes, "repeat": args.repeat, "database": database_url.split("://", 1)[0]},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "seed_seconds": seed_seconds,
+        "sizes": results,
+    }
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    results = asyncio.run(run(args, database_url))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"serialization-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    for size, stats in results["sizes"].items():
+        print(f"{size} users, {stats['body_bytes']} byte body")
+        print(f"  {'step':<18}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, step in stats["steps"].items():
+            print(f"  {name:<18}{step['p50_ms']:>10.2f}{step['p95_ms']:>10.2f}")
+        for name, pipeline in stats["pipelines"].items():
+            print(f"  {name:<18}{pipeline['p50_ms']:>10.2f}{pipeline['p95_ms']:>10.2f}{pipeline['users_per_second']:>12.0f} users/s")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
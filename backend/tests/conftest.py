@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+import tempfile
+import pytest
+import httpx
+
+# app modules read their settings at import time, so the environment is fixed before any of them is imported
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="auth-tests-"), "test.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{DATABASE_PATH}",
+    ASYNC_DATABASE_URL=f"sqlite+aiosqlite:///{DATABASE_PATH}",
+    ENVIRONMENT="test",
+    EMAIL_TRANSPORT="memory",
+    RATE_LIMIT_ENABLED="false",
+    AUDIT_ENABLED="false",
+    JWT_SECRET_KEY="test-only-secret-not-for-production",
+    ADMIN_EMAIL="admin@example.com",
+    ADMIN_PASSWORD="admin-password",
+    ARGON2_TIME_COST="1",
+    ARGON2_MEMORY_COST_KIB="1024",
+    ARGON2_PARALLELISM="1",
+    PASSWORD_HASH_MAX_PENDING="1000",
+)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+CODE = re.compile(r"verification code is: (\w+)")
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+async def app():
+    import bootstrap
+
+    bootstrap.reset_schema()
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        yield main.app
+
+@pytest.fixture
+async def client(app):
+    from database import AsyncSessionLocal
+    from models import Base
+    from auth_utils import invalidate_principal
+    from mailer import dispatcher
+    from revocation import denylist
+
+    # every test starts from empty tables and empty per-worker caches; rows are deleted through
+    # the app's own pool because DDL would wait on its idle SQLite connections
+    async with AsyncSessionLocal() as session:
+        for table in reversed(Base.metadata.sorted_tables):
+            await session.execute(table.delete())
+        await session.commit()
+    invalidate_principal()
+    denylist.clear()
+    dispatcher.transport.messages.clear()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=30) as client:
+        yield client
+
+async def sent_mail(email: str) -> list:
+    from mailer import dispatcher
+
+    await dispatcher.queue.join()
+    return [message for message in dispatcher.transport.messages if message["To"] == email]
+
+async def latest_code(email: str) -> str:
+    messages = await sent_mail(email)
+    return CODE.search(messages[-1].as_string()).group(1)
+
+def bearer(response) -> dict:
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def verified_user(client, email: str, password: str = "password") -> dict:
+    await client.post("/api/auth/register", json={"email": email, "password": password})
+    response = await client.post("/api/auth/verify-verification-code", json={"email": email, "code": await latest_code(email)})
+    return bearer(response)
+
+async def admin_user(client) -> dict:
+    await client.get("/api/admin/create-admin-user")
+    return bearer(await client.post("/api/auth/login", json={"email": os.environ["ADMIN_EMAIL"], "password": os.environ["ADMIN_PASSWORD"]}))
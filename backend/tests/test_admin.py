@@ -0,0 +1,19 @@
+import pytest
+from conftest import admin_user
+
+pytestmark = pytest.mark.anyio
+
+async def test_unset_admin_email_answers_401_not_500(client, monkeypatch):
+    import admin
+
+    headers = await admin_user(client)
+    assert (await client.get("/api/admin/admin/me", headers=headers)).status_code == 200
+
+    monkeypatch.setattr(admin, "ADMIN_EMAIL", None)
+    monkeypatch.setattr(admin, "ADMIN_EMAIL_CANONICAL", None)
+
+    assert (await client.get("/api/admin/admin/me", headers=headers)).status_code == 401
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 401
+    response = await client.get("/api/admin/create-admin-user")
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Admin user is not configured."
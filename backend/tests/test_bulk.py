@@ -0,0 +1,55 @@
+import json
+import pytest
+from conftest import admin_user
+
+pytestmark = pytest.mark.anyio
+
+def ndjson(rows: list) -> bytes:
+    return "\n".join(json.dumps(row) for row in rows).encode()
+
+async def test_bulk_create_reports_malformed_rows_and_keeps_going(client):
+    admin = await admin_user(client)
+    rows = [
+        {"email": 5, "password": "password"},
+        {"email": "ok@example.com", "password": ["not", "a", "string"]},
+        {"email": "   ", "password": "password"},
+        {"email": "ok@example.com", "password": "password"},
+    ]
+
+    response = await client.post("/api/admin/bulk-create-users", content=ndjson(rows), headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert [(row["row"], row["status"]) for row in response.json()["results"]] == [(1, "invalid"), (2, "invalid"), (3, "invalid"), (4, "created")]
+
+async def test_bulk_delete_reports_malformed_rows_and_keeps_going(client):
+    admin = await admin_user(client)
+    await client.post("/api/admin/bulk-create-users", content=ndjson([{"email": "gone@example.com", "password": "password"}]), headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    rows = [{"email": 5}, {"email": None}, {"email": "gone@example.com"}, {"email": "missing@example.com"}]
+    response = await client.post("/api/admin/bulk-delete-users", content=ndjson(rows), headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert [row["status"] for row in response.json()["results"]] == ["invalid", "invalid", "deleted", "not_found"]
+
+async def test_bulk_csv_keeps_newlines_inside_quoted_fields(client):
+    admin = await admin_user(client)
+    body = b'email,password\r\nfirst@example.com,"multi\nline ""pass"""\r\n\r\nsecond@example.com,password\r\n'
+
+    response = await client.post("/api/admin/bulk-create-users", content=body, headers={**admin, "Content-Type": "text/csv"})
+
+    assert [(row["row"], row["email"], row["status"]) for row in response.json()["results"]] == [
+        (1, "first@example.com", "created"),
+        (2, "second@example.com", "created"),
+    ]
+    login = await client.post("/api/auth/login", json={"email": "first@example.com", "password": 'multi\nline "pass"'})
+    assert login.status_code == 200
+
+async def test_bulk_delete_reports_repeated_emails_as_duplicates(client):
+    admin = await admin_user(client)
+    await client.post("/api/admin/bulk-create-users", content=ndjson([{"email": "gone@example.com", "password": "password"}]), headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    rows = [{"email": "gone@example.com"}, {"email": " GONE@example.com"}]
+    response = await client.post("/api/admin/bulk-delete-users", content=ndjson(rows), headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    assert [row["status"] for row in response.json()["results"]] == ["deleted", "duplicate"]
+    assert response.json()["succeeded"] == 1
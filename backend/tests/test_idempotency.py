@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+import httpx
+from conftest import sent_mail, verified_user
+
+pytestmark = pytest.mark.anyio
+
+def counting_app(body: bytes, status: int = 200, headers: list = (), delay: float = 0.05):
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await asyncio.sleep(delay)
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), *headers]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app, calls
+
+def middleware_client(app) -> httpx.AsyncClient:
+    from idempotency import IdempotencyMiddleware
+
+    middleware = IdempotencyMiddleware(app, routes={("POST", "/op"), ("POST", "/other")})
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test")
+
+async def test_concurrent_duplicates_run_once():
+    app, calls = counting_app(b'{"ok":true}')
+    async with middleware_client(app) as client:
+        responses = await asyncio.gather(*(client.post("/op", json={"a": 1}, headers={"Idempotency-Key": "k"}) for _ in range(10)))
+
+    assert calls == ["/op"]
+    assert {(response.status_code, response.content) for response in responses} == {(200, b'{"ok":true}')}
+    assert sum(response.headers.get("idempotent-replayed") == "true" for response in responses) == 9
+
+async def test_keys_are_scoped_to_caller_and_route():
+    app, calls = counting_app(b'{"ok":true}')
+    async with middleware_client(app) as client:
+        first = await client.post("/op", json={}, headers={"Idempotency-Key": "k", "Authorization": "Bearer one"})
+        other_caller = await client.post("/op", json={}, headers={"Idempotency-Key": "k", "Authorization": "Bearer two"})
+        other_route = await client.post("/other", json={}, headers={"Idempotency-Key": "k", "Authorization": "Bearer one"})
+        retry = await client.post("/op", json={}, headers={"Idempotency-Key": "k", "Authorization": "Bearer one"})
+
+    assert calls == ["/op", "/op", "/other"]
+    assert "idempotent-replayed" not in first.headers
+    assert "idempotent-replayed" not in other_caller.headers
+    assert "idempotent-replayed" not in other_route.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+
+async def test_key_reused_with_another_body_is_rejected():
+    app, calls = counting_app(b'{"ok":true}')
+    async with middleware_client(app) as client:
+        await client.post("/op", json={"a": 1}, headers={"Idempotency-Key": "k"})
+        response = await client.post("/op", json={"a": 2}, headers={"Idempotency-Key": "k"})
+
+    assert response.status_code == 422
+    assert len(calls) == 1
+
+@pytest.mark.parametrize("status, headers, body", [
+    (503, [], b'{"detail":"busy"}'),
+    (429, [], b'{"detail":"slow down"}'),
+    (400, [(b"retry-after", b"5")], b'{"detail":"later"}'),
+    (200, [], b'{"status":503,"message":"Error sending verification email"}'),
+    (200, [], b'{"status":429,"message":"try again later"}'),
+])
+async def test_retryable_responses_are_not_kept(status, headers, body):
+    app, calls = counting_app(body, status=status, headers=headers)
+    async with middleware_client(app) as client:
+        await client.post("/op", json={}, headers={"Idempotency-Key": "k"})
+        retry = await client.post("/op", json={}, headers={"Idempotency-Key": "k"})
+
+    assert len(calls) == 2
+    assert "idempotent-replayed" not in retry.headers
+
+async def test_duplicate_registrations_create_one_user_and_send_one_mail(client):
+    from sqlalchemy import select, func
+    from database import AsyncSessionLocal
+    from models import UserModel
+
+    payload = {"email": "dup@example.com", "password": "password"}
+    responses = await asyncio.gather(*(client.post("/api/auth/register", json=payload, headers={"Idempotency-Key": "signup-1"}) for _ in range(8)))
+
+    async with AsyncSessionLocal() as session:
+        users = await session.scalar(select(func.count()).select_from(UserModel).where(UserModel.email_canonical == "dup@example.com"))
+    assert users == 1
+    assert len(await sent_mail("dup@example.com")) == 1
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses}) == 1
+
+async def test_update_user_key_does_not_leak_between_users(client):
+    first = await verified_user(client, "first@example.com")
+    second = await verified_user(client, "second@example.com")
+
+    key = {"Idempotency-Key": "same-key"}
+    one = await client.put("/api/auth/update-user", json={"email": "first-new@example.com"}, headers={**first, **key})
+    two = await client.put("/api/auth/update-user", json={"email": "first-new@example.com"}, headers={**second, **key})
+
+    assert one.status_code == 200
+    # the second user really ran the update and hit the taken email, it did not get the first user's answer
+    assert two.status_code == 400
+    assert "idempotent-replayed" not in two.headers
+
+async def test_cooldown_answer_is_not_replayed_after_it_ends(client, monkeypatch):
+    import verification_codes
+
+    await client.post("/api/auth/register", json={"email": "resend@example.com", "password": "password"})
+    key = {"Idempotency-Key": "resend-1"}
+
+    throttled = await client.post("/api/auth/forgot-password", json={"email": "resend@example.com"}, headers=key)
+    assert throttled.status_code == 429
+    assert "retry-after" in throttled.headers
+
+    monkeypatch.setattr(verification_codes, "VERIFICATION_RESEND_COOLDOWN_SECONDS", 0)
+    retry = await client.post("/api/auth/forgot-password", json={"email": "resend@example.com"}, headers=key)
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert len(await sent_mail("resend@example.com")) == 2
@@ -0,0 +1,121 @@
+import smtplib
+import asyncio
+import pytest
+from email.message import Message
+
+pytestmark = pytest.mark.anyio
+
+def message(to: str) -> Message:
+    message = Message()
+    message["From"] = "noreply@example.com"
+    message["To"] = to
+    message.set_payload("hello")
+    return message
+
+class FakeServer:
+    def __init__(self, log: list, failures: list):
+        self.log = log
+        self.failures = failures # raised by the next sendmail calls, None sends
+
+    def sendmail(self, sender, recipients, body):
+        failure = self.failures.pop(0) if self.failures else None
+        self.log.append(("sendmail", recipients[0], failure is None))
+        if failure is not None:
+            raise failure
+
+    def noop(self):
+        self.log.append(("noop",))
+
+    def quit(self):
+        self.log.append(("quit",))
+
+def fake_transport(monkeypatch, failures: list):
+    from mailer import SMTPTransport
+
+    transport = SMTPTransport("smtp.example.com", 587, None, None)
+    log = []
+
+    def connect():
+        log.append(("connect",))
+        return FakeServer(log, failures)
+
+    monkeypatch.setattr(transport, "_connect", connect)
+    return transport, log
+
+async def test_pooled_connection_sends_without_probing(monkeypatch):
+    transport, log = fake_transport(monkeypatch, [])
+
+    assert transport.send_batch([message("a@example.com"), message("b@example.com")]) == [None, None]
+    assert transport.send_batch([message("c@example.com")]) == [None]
+
+    assert log == [("connect",), ("sendmail", "a@example.com", True), ("sendmail", "b@example.com", True), ("sendmail", "c@example.com", True)]
+
+async def test_dropped_connection_is_replaced_once(monkeypatch):
+    transport, log = fake_transport(monkeypatch, [])
+    transport.send_batch([message("a@example.com")])
+
+    transport._server.failures.append(smtplib.SMTPServerDisconnected("gone"))
+    assert transport.send_batch([message("b@example.com")]) == [None]
+    assert log[-4:] == [("sendmail", "b@example.com", False), ("quit",), ("connect",), ("sendmail", "b@example.com", True)]
+
+    # a connection that was just opened is not retried
+    transport.close()
+    failures = [smtplib.SMTPServerDisconnected("down")]
+    transport, log = fake_transport(monkeypatch, failures)
+    [error] = transport.send_batch([message("c@example.com")])
+    assert isinstance(error, smtplib.SMTPServerDisconnected)
+    assert log.count(("connect",)) == 1
+
+class FlakyTransport:
+    def __init__(self, failures: dict):
+        self.failures = failures # recipient -> errors raised on its next attempts
+        self.attempts = []
+
+    def send_batch(self, messages: list) -> list:
+        errors = []
+        for message in messages:
+            self.attempts.append(message["To"])
+            pending = self.failures.get(message["To"], [])
+            errors.append(pending.pop(0) if pending else None)
+        return errors
+
+    def close(self):
+        pass
+
+async def test_permanent_rejections_are_not_retried(monkeypatch):
+    import mailer
+
+    monkeypatch.setattr(mailer, "MAIL_RETRY_BASE_SECONDS", 0.01)
+    transport = FlakyTransport({
+        "gone@example.com": [smtplib.SMTPRecipientsRefused({"gone@example.com": (550, b"no such user")})],
+        "busy@example.com": [smtplib.SMTPRecipientsRefused({"busy@example.com": (451, b"try later")})],
+        "spam@example.com": [smtplib.SMTPDataError(554, b"rejected")],
+    })
+    dispatcher = mailer.MailDispatcher(transport)
+    dispatcher.start()
+    for to in ("gone@example.com", "busy@example.com", "spam@example.com"):
+        dispatcher.enqueue(message(to))
+
+    await asyncio.sleep(0.2)
+    await dispatcher.stop(timeout=1)
+
+    assert sorted(transport.attempts) == ["busy@example.com", "busy@example.com", "gone@example.com", "spam@example.com"]
+    assert dispatcher.stats["sent"] == 1
+    assert dispatcher.stats["failed"] == 2
+
+async def test_stop_sends_emails_waiting_in_backoff(monkeypatch):
+    import mailer
+
+    monkeypatch.setattr(mailer, "MAIL_RETRY_BASE_SECONDS", 60)
+    transport = FlakyTransport({"later@example.com": [smtplib.SMTPServerDisconnected("gone")]})
+    dispatcher = mailer.MailDispatcher(transport)
+    dispatcher.start()
+    dispatcher.enqueue(message("later@example.com"))
+    await asyncio.sleep(0.05)
+    assert len(dispatcher._retries) == 1
+
+    await dispatcher.stop(timeout=1)
+
+    assert transport.attempts == ["later@example.com", "later@example.com"]
+    assert dispatcher.stats["sent"] == 1
+    assert not dispatcher._retries
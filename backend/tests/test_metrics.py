@@ -0,0 +1,35 @@
+import time
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+pytestmark = pytest.mark.anyio
+
+def pending_entries(connection) -> dict:
+    return {key: len(value) for key, value in connection.info.items() if isinstance(value, list)}
+
+async def test_failed_statements_leave_nothing_on_the_connection(app):
+    from database import async_engine
+    from metrics import request_phases
+
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+        before = pending_entries(connection)
+
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                await connection.execute(text("SELECT * FROM missing_table"))
+        time.sleep(0.2)
+
+        phases = {}
+        token = request_phases.set(phases)
+        try:
+            await connection.execute(text("SELECT 1"))
+        finally:
+            request_phases.reset(token)
+
+        assert pending_entries(connection) == before
+
+    # timed from its own start, not from one of the failed statements
+    assert phases["db_count"] == 1
+    assert phases["db"] < 0.1
@@ -0,0 +1,98 @@
+import time
+import pytest
+from sqlalchemy import event
+from conftest import admin_user, verified_user
+
+pytestmark = pytest.mark.anyio
+
+ENDPOINTS = [
+    ("POST", "/api/admin/profiling/start", {"json": {}}),
+    ("POST", "/api/admin/profiling/stop", {}),
+    ("GET", "/api/admin/profiling/profiles", {}),
+    ("GET", "/api/admin/profiling/flamegraph", {}),
+]
+
+def listening(profiler) -> bool:
+    return any(
+        event.contains(engine, "before_cursor_execute", profiler._before_cursor_execute)
+        or event.contains(engine, "after_cursor_execute", profiler._after_cursor_execute)
+        for engine in profiler.engines
+    )
+
+@pytest.mark.parametrize("method, path, kwargs", ENDPOINTS)
+async def test_profiling_endpoints_are_admin_only(client, method, path, kwargs):
+    from profiling import profiler
+
+    user = await verified_user(client, "user@example.com")
+
+    assert (await client.request(method, path, **kwargs)).status_code == 401
+    assert (await client.request(method, path, headers=user, **kwargs)).status_code == 401
+    assert not profiler.enabled
+    assert not listening(profiler)
+
+async def test_profiling_is_off_by_default(client):
+    from profiling import Profiler, ProfilingMiddleware, profiler
+
+    user = await verified_user(client, "user@example.com")
+    for _ in range(3):
+        assert (await client.get("/api/auth/get-user-data", headers=user)).status_code == 200
+
+    assert not profiler.enabled
+    assert not listening(profiler)
+    assert len(profiler.profiles) == 0
+    assert profiler._sampler is None or not profiler._sampler.is_alive()
+
+    # a disabled middleware hands back the inner app's awaitable, it adds no frame to the request
+    async def inner(scope, receive, send):
+        pass
+
+    middleware = ProfilingMiddleware(inner, Profiler([]))
+    awaitable = middleware({"type": "http", "method": "GET", "path": "/"}, None, None)
+    assert awaitable.cr_code is inner.__code__
+    await awaitable
+
+async def test_admin_profiles_sampled_requests_until_stopped(client):
+    from profiling import profiler
+
+    admin = await admin_user(client)
+    try:
+        started = await client.post("/api/admin/profiling/start", headers=admin, json={"route": "/api/auth/get-user-data", "max_profiles": 2})
+        assert started.json()["enabled"] is True
+        assert listening(profiler)
+
+        for _ in range(3):
+            await client.get("/api/auth/get-user-data", headers=admin)
+        profiles = (await client.get("/api/admin/profiling/profiles", headers=admin)).json()
+        assert [profile["path"] for profile in profiles] == ["/api/auth/get-user-data"] * 2
+    finally:
+        stopped = await client.post("/api/admin/profiling/stop", headers=admin)
+        profiler.profiles.clear()
+
+    assert stopped.json()["enabled"] is False
+    assert not listening(profiler)
+
+async def test_failed_statements_do_not_skew_profiled_sql(client):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from database import async_engine
+    from profiling import profiler, current_profile
+
+    profile = {"sql": []}
+    profiler.start(None, 1.0, 60, 1)
+    token = current_profile.set(profile)
+    try:
+        async with async_engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    await connection.execute(text("SELECT * FROM missing_table"))
+            time.sleep(0.2)
+            await connection.execute(text("SELECT 1"))
+
+            assert not any(isinstance(value, list) and value for value in connection.info.values())
+    finally:
+        current_profile.reset(token)
+        profiler.stop()
+
+    [query] = profile["sql"]
+    assert query["statement"] == "SELECT 1"
+    assert query["ms"] < 100
@@ -0,0 +1,55 @@
+import pytest
+from conftest import admin_user, verified_user
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def trust_claims(monkeypatch):
+    import auth_utils
+
+    monkeypatch.setattr(auth_utils, "JWT_TRUST_CLAIMS", True)
+
+async def test_password_change_ends_tokens_when_trusting_claims(client, trust_claims):
+    old = await verified_user(client, "trust@example.com")
+    second = await verified_user(client, "other@example.com")
+
+    response = await client.post("/api/auth/update-password", headers=old, json={"password": "new-password"})
+    assert response.status_code == 200
+
+    assert (await client.get("/api/auth/get-user-data", headers=old)).status_code == 401
+    assert (await client.get("/api/auth/get-user-data", headers=second)).status_code == 200
+    login = await client.post("/api/auth/login", json={"email": "trust@example.com", "password": "new-password"})
+    new = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    assert (await client.get("/api/auth/get-user-data", headers=new)).status_code == 200
+
+async def test_deleted_users_tokens_are_rejected_when_trusting_claims(client, trust_claims):
+    admin = await admin_user(client)
+    single = await verified_user(client, "single@example.com")
+    everyone = await verified_user(client, "everyone@example.com")
+
+    await client.get("/api/admin/delete-user/single@example.com", headers=admin)
+    assert (await client.get("/api/auth/users/me", headers=single)).status_code == 401
+    assert (await client.get("/api/auth/users/me", headers=everyone)).status_code == 200
+
+    await client.get("/api/admin/delete-all-users", headers=admin)
+    assert (await client.get("/api/auth/users/me", headers=everyone)).status_code == 401
+    assert (await client.get("/api/auth/users/me", headers=admin)).status_code == 200
+
+async def test_other_workers_pick_up_revoked_sessions_on_sync(client, trust_claims):
+    from database import AsyncSessionLocal
+    from revocation import TokenDenylist, DELETED_USER_TOKEN_VERSION
+
+    admin = await admin_user(client)
+    await verified_user(client, "synced@example.com")
+    kept = (await client.get("/api/auth/get-user-data", headers=await verified_user(client, "kept@example.com"))).json()
+    await client.get("/api/admin/delete-user/synced@example.com", headers=admin)
+
+    other_worker = TokenDenylist()
+    async with AsyncSessionLocal() as session:
+        await other_worker.sync(session)
+
+    assert len(other_worker._sessions) == 1
+    [(user_id, (version, _))] = other_worker._sessions.items()
+    assert version == DELETED_USER_TOKEN_VERSION
+    assert other_worker.is_revoked_session(user_id, 0)
+    assert not other_worker.is_revoked_session(kept["id"], 0)
@@ -0,0 +1,105 @@
+import gc
+import asyncio
+import pytest
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from conftest import latest_code, bearer
+
+pytestmark = pytest.mark.anyio
+
+counting = ContextVar("counting", default=None)
+
+@contextmanager
+def round_trips():
+    # every statement and commit the requests made inside the block send; the app's background jobs
+    # run in their own context and are left out
+    from database import async_engine
+
+    counted = {"statements": [], "commits": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if counting.get() is counted:
+            counted["statements"].append(" ".join(statement.split()))
+
+    def commit(conn):
+        if counting.get() is counted:
+            counted["commits"] += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(async_engine.sync_engine, "commit", commit)
+    token = counting.set(counted)
+    try:
+        yield counted
+    finally:
+        counting.reset(token)
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(async_engine.sync_engine, "commit", commit)
+
+async def test_register_is_one_transaction_with_one_lookup(client):
+    with round_trips() as counted:
+        response = await client.post("/api/auth/register", json={"email": "new@example.com", "password": "password"})
+
+    assert response.status_code == 200
+    # the taken-email probe, then insert-or-nothing on the user, the stats counter and the code, committed together
+    assert len(counted["statements"]) == 4
+    assert counted["commits"] == 1
+    assert sum(statement.startswith("SELECT") for statement in counted["statements"]) == 1
+
+async def test_duplicate_register_is_a_single_lookup_without_hashing(client, monkeypatch):
+    import auth
+
+    await client.post("/api/auth/register", json={"email": "taken@example.com", "password": "password"})
+
+    async def hash_password(password):
+        raise AssertionError("a taken email must not be hashed")
+
+    monkeypatch.setattr(auth, "hash_password", hash_password)
+    with round_trips() as counted:
+        response = await client.post("/api/auth/register", json={"email": "Taken@Example.com", "password": "password"})
+
+    assert response.status_code == 400
+    assert len(counted["statements"]) == 1
+    assert counted["statements"][0].startswith("SELECT")
+
+async def test_verify_round_trips(client):
+    await client.post("/api/auth/register", json={"email": "verify@example.com", "password": "password"})
+    code = await latest_code("verify@example.com")
+
+    with round_trips() as counted:
+        response = await client.post("/api/auth/verify-verification-code", json={"email": "verify@example.com", "code": code})
+
+    assert response.status_code == 200
+    # consume the code, flip is_verified, bump the counters, store the refresh token
+    assert len(counted["statements"]) == 4
+    assert counted["commits"] == 1
+
+async def test_update_user_relies_on_the_unique_index(client):
+    await client.post("/api/auth/register", json={"email": "other@example.com", "password": "password"})
+    await client.post("/api/auth/register", json={"email": "mover@example.com", "password": "password"})
+    headers = bearer(await client.post("/api/auth/verify-verification-code", json={"email": "mover@example.com", "code": await latest_code("mover@example.com")}))
+    await client.get("/api/auth/users/me", headers=headers) # caches the principal
+
+    with round_trips() as counted:
+        taken = await client.put("/api/auth/update-user", json={"email": "other@example.com"}, headers=headers)
+    assert taken.status_code == 400
+    assert len(counted["statements"]) == 1
+
+    with round_trips() as counted:
+        moved = await client.put("/api/auth/update-user", json={"email": "moved@example.com"}, headers=headers)
+    assert moved.status_code == 200
+    assert len(counted["statements"]) == 1
+
+async def test_concurrent_registrations_of_one_email_do_not_fail(client):
+    # a collection on the event loop thread can finalize a SQLite cursor while another connection's thread
+    # sits in the busy handler, which stalls the loop, and the winner's commit with it, for the busy timeout
+    gc.disable()
+    try:
+        responses = await asyncio.gather(*(
+            client.post("/api/auth/register", json={"email": "race@example.com", "password": "password"})
+            for _ in range(10)
+        ))
+    finally:
+        gc.enable()
+
+    assert sorted(response.status_code for response in responses) == [200] + [400] * 9
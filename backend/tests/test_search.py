@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import text
+from conftest import admin_user
+
+pytestmark = pytest.mark.anyio
+
+EMAILS = ["Ann_Lee@Example.com", "annie@example.com", "bob@Company.io", "annXlee@example.com"]
+
+async def register_all(client):
+    for email in EMAILS:
+        await client.post("/api/auth/register", json={"email": email, "password": "password"})
+
+@pytest.mark.parametrize("mode, term, expected", [
+    ("prefix", "ANN_", ["Ann_Lee@Example.com"]),
+    ("prefix", "ann", ["Ann_Lee@Example.com", "annie@example.com", "annXlee@example.com"]),
+    ("domain", "Company.IO", ["bob@Company.io"]),
+    ("substring", "_lee@", ["Ann_Lee@Example.com"]),
+])
+async def test_search_matches_the_canonical_email(client, mode, term, expected):
+    from search import snapshot
+
+    admin = await admin_user(client)
+    await register_all(client)
+    snapshot.loaded_at = None
+
+    response = await client.get("/api/admin/search-users", headers=admin, params={"mode": mode, "q": term})
+
+    assert [user["email"] for user in response.json()["users"]] == expected
+    assert response.json()["total"] == len(expected)
+
+async def test_listing_prefix_filter_escapes_wildcards(client):
+    admin = await admin_user(client)
+    await register_all(client)
+
+    response = await client.get("/api/admin/fetch-users-data", headers=admin, params={"email_prefix": " Ann_"})
+
+    assert [user["email"] for user in response.json()["users"]] == ["Ann_Lee@Example.com"]
+
+async def test_bootstrap_drops_the_lower_email_indexes(app):
+    import bootstrap
+
+    with bootstrap.engine.begin() as connection:
+        connection.execute(text("CREATE INDEX ix_users_email_lower ON users (lower(email))"))
+
+    bootstrap.create_schema()
+
+    with bootstrap.engine.connect() as connection:
+        assert "ix_users_email_lower" not in bootstrap.existing_index_names(connection, "users")
@@ -0,0 +1,52 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import select, update, func
+from conftest import verified_user
+
+pytestmark = pytest.mark.anyio
+
+async def shard_totals() -> dict:
+    from database import AsyncSessionLocal
+    from models import UserStatsModel
+    from stats import COUNTERS
+
+    async with AsyncSessionLocal() as session:
+        row = (await session.execute(select(*(func.sum(getattr(UserStatsModel, name)) for name in COUNTERS)))).one()
+    return dict(zip(COUNTERS, row))
+
+async def test_recount_corrects_drift_and_keeps_every_shard(client):
+    from database import AsyncSessionLocal
+    from models import UserStatsModel
+    from stats import reconcile_stats, STATS_SHARDS
+
+    await reconcile_stats()
+    await verified_user(client, "one@example.com")
+    await client.post("/api/auth/register", json={"email": "two@example.com", "password": "password"})
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(UserStatsModel).where(UserStatsModel.shard == 3).values(users=UserStatsModel.users + 5))
+        await session.commit()
+
+    drift = await reconcile_stats()
+
+    assert drift == {"users": -5, "verified": 0, "admins": 0, "pending_codes": 0}
+    assert await shard_totals() == {"users": 2, "verified": 1, "admins": 0, "pending_codes": 1}
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(func.count()).select_from(UserStatsModel)) == STATS_SHARDS
+
+async def test_skipped_recount_still_seeds_missing_shards(client):
+    from database import AsyncSessionLocal
+    from models import UserStatsModel
+    from stats import reconcile_stats, STATS_SHARDS
+
+    # another worker recounted a moment ago, but only its shard row exists
+    async with AsyncSessionLocal() as session:
+        session.add(UserStatsModel(shard=0, users=0, verified=0, admins=0, pending_codes=0, reconciled_at=datetime.utcnow()))
+        await session.commit()
+
+    assert await reconcile_stats(max_age=3600) is None
+
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(func.count()).select_from(UserStatsModel)) == STATS_SHARDS
+    await client.post("/api/auth/register", json={"email": "counted@example.com", "password": "password"})
+    assert (await shard_totals())["users"] == 1
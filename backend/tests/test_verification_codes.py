@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from conftest import CODE, sent_mail, verified_user
+
+pytestmark = pytest.mark.anyio
+
+async def stored_codes() -> list:
+    from database import AsyncSessionLocal
+    from models import VerificationCodeModel
+
+    async with AsyncSessionLocal() as session:
+        return list((await session.scalars(select(VerificationCodeModel.code).order_by(VerificationCodeModel.id))).all())
+
+async def mailed_codes(email: str) -> list:
+    return [CODE.search(message.as_string()).group(1) for message in await sent_mail(email)]
+
+async def test_burst_of_resends_writes_one_code_and_sends_one_email(client):
+    await verified_user(client, "burst@example.com")
+    assert await stored_codes() == []
+
+    responses = await asyncio.gather(*(client.post("/api/auth/forgot-password", json={"email": "burst@example.com"}) for _ in range(20)))
+
+    assert {response.status_code for response in responses} == {200}
+    codes = await stored_codes()
+    assert len(codes) == 1
+    # the registration mail, then the one resend
+    assert (await mailed_codes("burst@example.com"))[1:] == codes
+
+async def test_resend_within_cooldown_is_429_with_retry_after(client):
+    await verified_user(client, "cooldown@example.com")
+    assert (await client.post("/api/auth/forgot-password", json={"email": "cooldown@example.com"})).status_code == 200
+
+    response = await client.post("/api/auth/forgot-password", json={"email": "cooldown@example.com"})
+
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 60
+    assert len(await stored_codes()) == 1
+    assert len(await sent_mail("cooldown@example.com")) == 2
+
+async def test_resend_after_cooldown_reuses_the_recent_code(client, monkeypatch):
+    import verification_codes
+
+    await verified_user(client, "reuse@example.com")
+    await client.post("/api/auth/forgot-password", json={"email": "reuse@example.com"})
+    monkeypatch.setattr(verification_codes, "VERIFICATION_RESEND_COOLDOWN_SECONDS", 0)
+
+    response = await client.post("/api/auth/forgot-password", json={"email": "reuse@example.com"})
+
+    assert response.status_code == 200
+    codes = await stored_codes()
+    assert len(codes) == 1
+    assert (await mailed_codes("reuse@example.com"))[1:] == codes * 2
+
+    # past the reuse window a fresh code is minted, next to the old one
+    monkeypatch.setattr(verification_codes, "VERIFICATION_CODE_REUSE_SECONDS", 0)
+    await client.post("/api/auth/forgot-password", json={"email": "reuse@example.com"})
+
+    codes = await stored_codes()
+    assert len(codes) == 2
+    assert (await mailed_codes("reuse@example.com"))[1:] == [codes[0], codes[0], codes[1]]